@@ -0,0 +1,131 @@
+import os, sys, json, time, argparse, datetime, platform, subprocess, tempfile
+import numpy as np
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(PROJECT_DIR)
+sys.path.append(f'{PROJECT_DIR}/src')
+sys.path.append(f'{PROJECT_DIR}/benchmarks')
+
+import tensorflow as tf
+
+import images, labels, models
+import synthetic
+
+RESULTS_DIR = f'{PROJECT_DIR}/benchmarks/results'
+
+HEIGHT = 224
+WIDTH = 224
+
+def timed(fn, repeats, warmup=1):
+    """Median seconds per call"""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+def bench_load_image(work_dir, count):
+    paths = synthetic.make_images(os.path.join(work_dir, 'images'), count)
+
+    dataset = (tf.data.Dataset.from_tensor_slices(paths)
+        .map(lambda path: images.load_image(path, HEIGHT, WIDTH), num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        .batch(32)
+    )
+
+    seconds = timed(lambda: [None for _ in dataset], repeats=3)
+    return {'images': count, 'images_per_sec': count / seconds}
+
+def bench_model(batch_sizes, repeats):
+    model = models.init_model_continuous(HEIGHT, WIDTH, pretrained=False)
+
+    results = {}
+    for batch_size in batch_sizes:
+        x = np.random.uniform(0, 255, (batch_size, HEIGHT, WIDTH, 3)).astype(np.float32)
+        y = np.random.uniform(1, 5, (batch_size, 1)).astype(np.float32)
+
+        forward = timed(lambda: model(x, training=False), repeats)
+        train_step = timed(lambda: model.train_on_batch(x, y), repeats)
+
+        predict_x = np.repeat(x, 4, axis=0)
+        predict = timed(lambda: model.predict(predict_x, batch_size=batch_size, verbose=0), repeats)
+
+        results[str(batch_size)] = {
+            'forward_ms': forward * 1000,
+            'train_step_ms': train_step * 1000,
+            'predict_images_per_sec': len(predict_x) / predict,
+        }
+
+    return results
+
+def bench_labels(work_dir, row_counts, image_count):
+    image_dir = os.path.join(work_dir, 'images')
+    synthetic.make_images(image_dir, image_count)
+
+    results = {}
+    for rows in row_counts:
+        mos_path = os.path.join(work_dir, f'mos_{rows}.csv')
+        synthetic.make_mos_csv(mos_path, rows)
+
+        index_path = labels._index_path(mos_path)
+        def cold():
+            if os.path.isfile(index_path):
+                os.remove(index_path)
+            labels._load_data(mos_path, image_dir)
+
+        results[str(rows)] = {
+            'cold_seconds': timed(cold, repeats=1, warmup=0),
+            'warm_seconds': timed(lambda: labels._load_data(mos_path, image_dir), repeats=3),
+        }
+
+    return results
+
+def environment():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=PROJECT_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'tensorflow': tf.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='CPU benchmarks for data loading, training and inference; results are written as JSON')
+    parser.add_argument('--only', nargs='+', choices=['load_image', 'model', 'labels'], default=['load_image', 'model', 'labels'])
+    parser.add_argument('--images', type=int, default=512, help='synthetic JPEGs to decode')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--label-rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--work-dir', default=None, help='where synthetic data is kept (default: temporary directory)')
+    parser.add_argument('-o', '--output', default=None)
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='iqa-bench-')
+
+    report = {'environment': environment(), 'results': {}}
+
+    if 'load_image' in args.only:
+        report['results']['load_image'] = bench_load_image(work_dir, args.images)
+    if 'model' in args.only:
+        report['results']['model'] = bench_model(args.batch_sizes, args.repeats)
+    if 'labels' in args.only:
+        report['results']['labels'] = bench_labels(work_dir, args.label_rows, args.images)
+
+    output = args.output or f"{RESULTS_DIR}/{datetime.datetime.now().strftime('%y-%m-%d_%H-%M-%S')}.json"
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=4)
+
+    print(json.dumps(report['results'], indent=4))
+    print(f"Saved results to {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+import os, csv
+import numpy as np
+import tensorflow as tf
+
+def make_images(out_dir, count, height=512, width=512, seed=0):
+    """Writes random-noise JPEGs and returns their paths; existing files are reused"""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    paths = []
+    for i in range(count):
+        path = os.path.join(out_dir, f'synthetic_{i:07}.jpg')
+        if not os.path.isfile(path):
+            pixels = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+            tf.io.write_file(path, tf.io.encode_jpeg(pixels, quality=90))
+        paths.append(path)
+
+    return paths
+
+def make_mos_csv(path, rows, seed=0):
+    """Writes a mos.csv with `rows` entries in random order, named like make_images output"""
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(rows)
+    scores = rng.uniform(1.0, 5.0, rows)
+
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['image', 'mos'])
+        for i in order:
+            writer.writerow([f'synthetic_{i:07}.jpg', f'{scores[i]:.4f}'])
@@ -0,0 +1,185 @@
+import os, sys, csv, glob, argparse, traceback
+import tensorflow as tf
+import numpy as np
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(f'{PROJECT_DIR}/src')
+
+import images, models
+
+MODEL_NAME = ''
+MODEL_PATH = f'{PROJECT_DIR}/output/{MODEL_NAME}/model.keras'
+
+BATCH_SIZE = 256
+EXTENSIONS = ('.jpg', '.jpeg')
+
+tf.keras.config.enable_unsafe_deserialization()
+
+def iter_inputs(inputs):
+    """Yields image paths from directories (recursively), glob patterns and .txt file lists"""
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(EXTENSIONS):
+                        yield os.path.join(root, name)
+        elif item.endswith('.txt') and os.path.isfile(item):
+            with open(item, 'r') as file:
+                for line in file:
+                    line = line.strip()
+                    if line:
+                        yield line
+        else:
+            yield from sorted(glob.glob(item, recursive=True))
+
+class CsvWriter:
+    HEADER = ('path', 'score')
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.isfile(path):
+            self._drop_partial_line()
+
+    @staticmethod
+    def _is_score(row):
+        if len(row) != 2:
+            return False
+        try:
+            float(row[1])
+        except ValueError:
+            return False
+        return True
+
+    def scored(self):
+        """Paths of complete rows; the header and malformed rows are not counted"""
+        if not os.path.isfile(self.path):
+            return set()
+        with open(self.path, 'r', newline='') as file:
+            return {row[0] for row in csv.reader(file) if self._is_score(row)}
+
+    def _drop_partial_line(self):
+        """Cuts an unterminated last line left by an interrupted run, whose score may have lost digits; the image is scored again"""
+        with open(self.path, 'rb+') as file:
+            data = file.read()
+            if data and not data.endswith(b'\n'):
+                file.truncate(data.rfind(b'\n') + 1)
+
+    def write(self, paths, scores):
+        with open(self.path, 'a', newline='') as file:
+            writer = csv.writer(file)
+            if file.tell() == 0:
+                writer.writerow(self.HEADER)
+            writer.writerows(zip(paths, scores))
+
+class PartWriter:
+    """Writes one part file per batch into a directory; used for formats that cannot be appended to"""
+    def __init__(self, path, extension):
+        self.path = path
+        self.extension = extension
+        os.makedirs(path, exist_ok=True)
+        self.parts = len(self._part_files())
+
+    def _part_files(self):
+        return sorted(glob.glob(os.path.join(self.path, f'part-*{self.extension}')))
+
+    def _next_part(self):
+        self.parts += 1
+        return os.path.join(self.path, f'part-{self.parts:06}{self.extension}')
+
+class NpyWriter(PartWriter):
+    def __init__(self, path):
+        super().__init__(path, '.npz')
+
+    def scored(self):
+        done = set()
+        for part in self._part_files():
+            with np.load(part) as data:
+                done.update(data['paths'].tolist())
+        return done
+
+    def write(self, paths, scores):
+        part = self._next_part()
+        with open(f'{part}.tmp', 'wb') as file:
+            np.savez(file, paths=np.array(paths), scores=np.array(scores, dtype=np.float32))
+        os.replace(f'{part}.tmp', part)
+
+class ParquetWriter(PartWriter):
+    def __init__(self, path):
+        import pyarrow, pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        super().__init__(path, '.parquet')
+
+    def scored(self):
+        done = set()
+        for part in self._part_files():
+            done.update(self.pq.read_table(part, columns=['path']).column('path').to_pylist())
+        return done
+
+    def write(self, paths, scores):
+        part = self._next_part()
+        table = self.pa.table({'path': list(paths), 'score': np.array(scores, dtype=np.float32)})
+        self.pq.write_table(table, f'{part}.tmp')
+        os.replace(f'{part}.tmp', part)
+
+WRITERS = {
+    'csv': CsvWriter,
+    'npy': NpyWriter,
+    'parquet': ParquetWriter,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description='Score unlabeled images with a trained model, streaming results to disk')
+    parser.add_argument('inputs', nargs='+', help='directories, glob patterns or .txt files with one path per line')
+    parser.add_argument('-o', '--output', required=True, help='csv file, or directory of part files for npy/parquet')
+    parser.add_argument('-f', '--format', choices=WRITERS.keys(), default='csv')
+    parser.add_argument('-m', '--model', default=MODEL_PATH)
+    parser.add_argument('-b', '--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    writer = WRITERS[args.format](args.output)
+
+    scored = writer.scored()
+    if scored:
+        print(f"Resuming: {len(scored)} images already scored")
+
+    try:
+        model = models.load_model(args.model)
+        print(f"Loaded model")
+    except Exception as e:
+        print(f"Fatal error while loading model at: {args.model}")
+        traceback.print_exc()
+        sys.exit(-1)
+
+    height, width = model.input_shape[1:3]
+
+    def pending():
+        for path in iter_inputs(args.inputs):
+            if path not in scored:
+                yield path
+
+    def load(path):
+        return path, images.load_image(path, height, width)
+
+    dataset = (tf.data.Dataset.from_generator(pending, output_signature=tf.TensorSpec(shape=(), dtype=tf.string))
+        .map(load, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        .ignore_errors(log_warning=True)
+        .batch(args.batch_size)
+        .prefetch(tf.data.experimental.AUTOTUNE)
+    )
+
+    total = 0
+    for paths, batch in dataset:
+        scores = model.predict_on_batch(batch).flatten()
+        paths = [path.decode() for path in paths.numpy()]
+
+        writer.write(paths, scores.tolist())
+
+        total += len(paths)
+        print(f"Scored {total} images", end='\r')
+
+    print(f"\nScored {total} new images, results in {args.output}")
+
+if __name__ == '__main__':
+    main()
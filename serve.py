@@ -0,0 +1,86 @@
+import os, sys, argparse, traceback
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import tensorflow as tf
+from flask import Flask, request, jsonify
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(f'{PROJECT_DIR}/src')
+
+import images, models
+from batcher import DynamicBatcher
+
+MODEL_NAME = ''
+MODEL_PATH = f'{PROJECT_DIR}/output/{MODEL_NAME}/model.keras'
+
+MAX_BATCH = 32
+MAX_LATENCY_MS = 10
+TIMEOUT = 30
+
+tf.keras.config.enable_unsafe_deserialization()
+
+def create_app(model, max_batch, max_latency):
+    app = Flask(__name__)
+
+    height, width = model.input_shape[1:3]
+    batcher = DynamicBatcher(model.predict_on_batch, max_batch=max_batch, max_latency=max_latency)
+
+    def decode(data):
+        return images.decode_image(data, height, width).numpy()
+
+    @app.route('/score', methods=['POST'])
+    def score():
+        """Accepts multipart uploads under 'image', or JSON {"paths": [...]} of files readable by the server"""
+        try:
+            if request.files:
+                files = request.files.getlist('image')
+                names = [file.filename for file in files]
+                decoded = [decode(file.read()) for file in files]
+            else:
+                names = (request.get_json(silent=True) or {}).get('paths', [])
+                decoded = [decode(tf.io.read_file(path)) for path in names]
+        except Exception as e:
+            return jsonify({'error': f'could not read image: {e}'}), 400
+
+        if not decoded:
+            return jsonify({'error': "no images given, expected 'image' uploads or a 'paths' list"}), 400
+
+        futures = [batcher.submit(image) for image in decoded]
+        try:
+            scores = [future.result(timeout=TIMEOUT) for future in futures]
+        except FutureTimeoutError:
+            return jsonify({'error': f'scoring did not finish within {TIMEOUT} seconds'}), 504
+
+        return jsonify({'scores': [{'name': name, 'score': s} for name, s in zip(names, scores)]})
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return jsonify(batcher.metrics())
+
+    @app.route('/health', methods=['GET'])
+    def health():
+        return jsonify({'status': 'ok'})
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP scoring service with dynamic request batching')
+    parser.add_argument('-m', '--model', default=MODEL_PATH)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH)
+    parser.add_argument('--max-latency-ms', type=float, default=MAX_LATENCY_MS)
+    args = parser.parse_args()
+
+    try:
+        model = models.load_model(args.model)
+        print(f"Loaded model")
+    except Exception as e:
+        print(f"Fatal error while loading model at: {args.model}")
+        traceback.print_exc()
+        sys.exit(-1)
+
+    app = create_app(model, args.max_batch, args.max_latency_ms / 1000)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,53 @@
 import tensorflow as tf
-import models
 
 class BatchCallback(tf.keras.callbacks.Callback):
 
-    def __init__(self, tracker, target_epochs, model_path, batches_per_epoch, **kwargs):
+    def __init__(self, tracker, target_epochs, checkpointer, batches_per_epoch, initial_batch=0, **kwargs):
         super().__init__(**kwargs)
         self.tracker = tracker
         self.target_epochs = target_epochs
-        self.model_path = model_path
+        self.checkpointer = checkpointer
         self.batches_per_epoch = batches_per_epoch
 
-    def on_batch_end(self, batch, logs=None):
-        self.tracker.batch = batch + 1
-        self.tracker.log(f"Completed batch {self.tracker.batch}/{self.batches_per_epoch} of epoch {self.tracker.epoch}/{self.target_epochs}")
+        # batches already trained in the first epoch when resuming mid-epoch
+        self.initial_batch = initial_batch
 
-        self.tracker.save_status()
-        
-        self.tracker.log(f"Saved status and history")
+    def on_batch_end(self, batch, logs=None):
+        self.tracker.batch = self.initial_batch + batch + 1
+        self.tracker.progress(f"Completed batch {self.tracker.batch}/{self.batches_per_epoch} of epoch {self.tracker.epoch}/{self.target_epochs}")
 
     def on_epoch_end(self, epoch, logs=None):
         self.tracker.epoch = epoch + 1
         self.tracker.batch = 0
+        self.initial_batch = 0
 
         self.tracker.log(f"Completed epoch {self.tracker.epoch}/{self.target_epochs} completed")
-        
-        self.tracker.save_status()
-        models.save_model(self.model, self.model_path)
-        
-        self.tracker.log(f"Saved model")
+
+        # the status moves to the new epoch only once its checkpoint is on disk
+        completed = self.tracker.epoch
+        self.checkpointer.save(self.model, completed, on_written=lambda: self.tracker.mark_saved(completed))
+
+        self.tracker.log(f"Started checkpoint write")
+        self.tracker.flush()
+
+    def on_train_end(self, logs=None):
+        self.checkpointer.wait()
+
+class ContinuedEarlyStopping(tf.keras.callbacks.EarlyStopping):
+    """
+    EarlyStopping whose patience count, best value and best weights carry over between fit calls,
+    i.e. from the partial first epoch of a mid-epoch resume to the remaining epochs
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._state = None
+
+    def on_train_begin(self, logs=None):
+        super().on_train_begin(logs)
+        if self._state is not None:
+            self.wait, self.best, self.best_weights, self.best_epoch = self._state
+
+    def on_train_end(self, logs=None):
+        super().on_train_end(logs)
+        self._state = (self.wait, self.best, self.best_weights, self.best_epoch)
@@ -0,0 +1,89 @@
+import threading, queue, time
+from concurrent.futures import Future
+import numpy as np
+
+class DynamicBatcher:
+    """
+    Groups concurrent single-image requests into micro-batches.
+
+    A batch is sent to the model once it holds `max_batch` images, or once the oldest
+    queued image has waited `max_latency` seconds, whichever comes first.
+    """
+    def __init__(self, predict_fn, max_batch=32, max_latency=0.01, window=1000):
+        self.predict_fn = predict_fn
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._latencies = np.zeros(window, dtype=np.float64)
+        self._latency_count = 0
+        self._batches = 0
+        self._images = 0
+
+        self._thread = threading.Thread(target=self._run, name='dynamic-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, image):
+        """Queues one preprocessed image; the returned future resolves to its score"""
+        future = Future()
+        self._queue.put((image, future, time.perf_counter()))
+        return future
+
+    def _collect(self):
+        items = [self._queue.get()]
+        deadline = items[0][2] + self.max_latency
+
+        while len(items) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            futures = [item[1] for item in items]
+
+            try:
+                scores = np.asarray(self.predict_fn(np.stack([item[0] for item in items]))).reshape(-1)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            done = time.perf_counter()
+            for (_, future, queued), score in zip(items, scores):
+                future.set_result(float(score))
+                self._record(done - queued)
+
+            with self._lock:
+                self._batches += 1
+                self._images += len(items)
+
+    def _record(self, latency):
+        with self._lock:
+            self._latencies[self._latency_count % len(self._latencies)] = latency
+            self._latency_count += 1
+
+    def metrics(self):
+        with self._lock:
+            recent = self._latencies[:min(self._latency_count, len(self._latencies))]
+            p50, p95, p99 = np.percentile(recent, [50, 95, 99]) if len(recent) else (0.0, 0.0, 0.0)
+
+            return {
+                'queue_depth': self._queue.qsize(),
+                'images': self._images,
+                'batches': self._batches,
+                'mean_batch_size': self._images / self._batches if self._batches else 0.0,
+                'latency_ms': {
+                    'p50': p50 * 1000,
+                    'p95': p95 * 1000,
+                    'p99': p99 * 1000,
+                },
+            }
@@ -0,0 +1,104 @@
+import os, re, glob, threading
+import numpy as np
+
+PATTERN = re.compile(r'ckpt-(\d+)\.npz$')
+
+def _frozen_variable_ids(layer):
+    """Variables of frozen layers never change, so they are left to the base .keras archive"""
+    ids = set()
+    for sublayer in getattr(layer, 'layers', []):
+        if not sublayer.trainable:
+            ids.update(id(v) for v in sublayer.weights)
+        else:
+            ids.update(_frozen_variable_ids(sublayer))
+    return ids
+
+def _variables(model):
+    frozen = _frozen_variable_ids(model)
+    weights = [(i, v) for i, v in enumerate(model.weights) if id(v) not in frozen]
+    return weights, list(model.optimizer.variables)
+
+def list_checkpoints(checkpoint_dir):
+    """(epoch, path) pairs, oldest first"""
+    found = []
+    for path in glob.glob(os.path.join(checkpoint_dir, 'ckpt-*.npz')):
+        match = PATTERN.search(path)
+        if match:
+            found.append((int(match.group(1)), path))
+    return sorted(found)
+
+def restore(model, path):
+    """Assigns checkpointed weights and optimizer state onto a model of the same architecture"""
+    if not model.optimizer.built:
+        model.optimizer.build(model.trainable_variables)
+
+    weights, opt_vars = _variables(model)
+
+    with np.load(path) as data:
+        for i, v in weights:
+            v.assign(data[f'w{i}'])
+        for i, v in enumerate(opt_vars):
+            v.assign(data[f'o{i}'])
+        return int(data['epoch'])
+
+def restore_latest(model, checkpoint_dir):
+    """Returns the restored epoch, or None if there is no checkpoint"""
+    found = list_checkpoints(checkpoint_dir)
+    if not found:
+        return None
+    return restore(model, found[-1][1])
+
+class Checkpointer:
+    """
+    Incremental, asynchronous checkpoints of the trainable part of a model.
+
+    Only variables that can change during training (trainable weights, batchnorm statistics
+    of trainable layers, optimizer slots) are saved. Tensors are copied to host memory on the
+    calling thread and written to disk by a background thread; the last `keep` checkpoints are kept.
+    `on_written` is called on that thread once the checkpoint file is in place.
+    """
+    def __init__(self, checkpoint_dir, keep=3):
+        self.checkpoint_dir = checkpoint_dir
+        self.keep = keep
+        self._thread = None
+        self.error = None
+
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def save(self, model, epoch, on_written=None):
+        self.wait()
+
+        weights, opt_vars = _variables(model)
+        snapshot = {f'w{i}': v.numpy() for i, v in weights}
+        snapshot.update({f'o{i}': v.numpy() for i, v in enumerate(opt_vars)})
+        snapshot['epoch'] = np.array(epoch)
+
+        self._thread = threading.Thread(target=self._write, args=(snapshot, epoch, on_written), name='checkpoint-writer')
+        self._thread.start()
+
+    def _write(self, snapshot, epoch, on_written):
+        try:
+            path = os.path.join(self.checkpoint_dir, f'ckpt-{epoch:04}.npz')
+            tmp_path = f'{path}.tmp'
+
+            with open(tmp_path, 'wb') as file:
+                np.savez(file, **snapshot)
+            os.replace(tmp_path, path)
+
+            if on_written is not None:
+                on_written()
+
+            for _, old in list_checkpoints(self.checkpoint_dir)[:-self.keep]:
+                os.remove(old)
+        except Exception as e:
+            self.error = e
+
+    def wait(self):
+        """Blocks until the pending write is done; re-raises its error, if any"""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
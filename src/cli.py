@@ -0,0 +1,20 @@
+import sys, importlib.util
+
+def lazy_import(name):
+    """
+    Module whose import runs on first attribute access, so --help, config checks
+    and dataset scans never pay for TensorFlow, scipy or matplotlib
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
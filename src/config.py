@@ -0,0 +1,163 @@
+import os, json
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+CONFIG_NAME = 'run_config.json'
+LOCK_NAME = '.lock'
+
+class ConfigError(ValueError):
+    pass
+
+def settings(namespace, derived=()):
+    """Upper-case module constants with plain json values, i.e. what a run config may override"""
+    plain = (type(None), bool, int, float, str, list, tuple)
+    return {
+        name: value for name, value in namespace.items()
+        if name.isupper() and name not in derived and isinstance(value, plain)
+    }
+
+def add_arguments(parser):
+    parser.add_argument('--config', action='append', default=[], metavar='FILE',
+                        help='json file of setting overrides, e.g. {"FIT_BATCH_SIZE": 16}; may be repeated')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE', dest='overrides',
+                        help='override one setting, the value is parsed as json; applied after --config files')
+    parser.add_argument('--run', metavar='NAME', help='run name, shorthand for --set MODEL_NAME=NAME')
+    parser.add_argument('--print-config', action='store_true', help='print the effective settings and exit')
+
+def _parse_value(text):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return text
+
+def overrides(args):
+    """Setting overrides from the parsed arguments, in order: config files, --set, --run"""
+    values = {}
+    for path in args.config:
+        with open(path, 'r') as file:
+            values.update(json.load(file))
+
+    for item in args.overrides:
+        name, sep, text = item.partition('=')
+        if not sep:
+            raise ConfigError(f"Expected NAME=VALUE, got {item!r}")
+        values[name.strip()] = _parse_value(text)
+
+    if args.run is not None:
+        values['MODEL_NAME'] = args.run
+    return values
+
+def apply(namespace, values, derived=()):
+    """Overrides module constants in place; unknown names are an error rather than silently ignored"""
+    known = settings(namespace, derived)
+    unknown = sorted(set(values) - set(known))
+    if unknown:
+        raise ConfigError(f"Unknown settings: {', '.join(unknown)}")
+
+    for name, value in values.items():
+        if isinstance(known[name], tuple) and isinstance(value, list):
+            value = tuple(value)
+        namespace[name] = value
+
+def dump(namespace, path, derived=()):
+    with open(path, 'w') as file:
+        json.dump(settings(namespace, derived), file, indent=4)
+
+def lock_run_dir(run_dir):
+    """
+    Exclusive lock on a run directory for the lifetime of the process, so two runs on one host
+    can never write the same status and model files. Returns the handle to keep open, or None if taken.
+    """
+    os.makedirs(run_dir, exist_ok=True)
+    handle = open(os.path.join(run_dir, LOCK_NAME), 'w')
+    if fcntl is None:
+        return handle
+
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+def parse_cores(spec):
+    """'0-7,16-23' or a list of core ids -> sorted core ids"""
+    if isinstance(spec, (list, tuple)):
+        return sorted(int(core) for core in spec)
+
+    cores = set()
+    for part in str(spec).split(','):
+        low, sep, high = part.strip().partition('-')
+        cores.update(range(int(low), int(high) + 1) if sep else [int(low)])
+    return sorted(cores)
+
+def pin_cpus(cores=None, threads=None):
+    """
+    Restricts the process to `cores` and sizes OpenMP to match. Must run before tensorflow is imported,
+    since the OpenMP and oneDNN pools read their size once at startup. numpy reads OMP_NUM_THREADS when it is
+    imported, so in train.py and test.py its BLAS pool keeps its size and only the affinity applies to it.
+    """
+    if cores is not None:
+        cores = parse_cores(cores)
+        if hasattr(os, 'sched_setaffinity'):
+            # affinity is per thread on linux: pin the ones already started, e.g. by numpy, new ones inherit it
+            tasks = os.listdir('/proc/self/task') if os.path.isdir('/proc/self/task') else ['0']
+            for task in tasks:
+                try:
+                    os.sched_setaffinity(int(task), cores)
+                except (ProcessLookupError, PermissionError):
+                    pass
+        threads = threads or len(cores)
+
+    if threads:
+        os.environ['OMP_NUM_THREADS'] = str(threads)
+    return cores
+
+def set_tf_threads(intra=None, inter=None):
+    """Must run before tensorflow executes its first op"""
+    import tensorflow as tf
+
+    if intra:
+        tf.config.threading.set_intra_op_parallelism_threads(intra)
+    if inter:
+        tf.config.threading.set_inter_op_parallelism_threads(inter)
+
+def with_data_threads(dataset, threads=None):
+    """Gives a tf.data pipeline its own threadpool of `threads` instead of sharing tensorflow's inter-op pool"""
+    if not threads:
+        return dataset
+
+    import tensorflow as tf
+
+    options = tf.data.Options()
+    options.threading.private_threadpool_size = threads
+    return dataset.with_options(options)
+
+def available_cpus():
+    """Cores this process may run on, which is fewer than the machine has under taskset or a cgroup cpuset"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def tuned(path, section, pinned=False):
+    """
+    Settings tools/tune_threads.py wrote for this machine, or {} if it was tuned with a different number of cores.
+    Thread counts are tuned for all available cores, so with pinned=True (CPU_CORES set) they are left out
+    and the pool sizes follow the pinned core count instead.
+    """
+    if not os.path.isfile(path):
+        return {}
+
+    with open(path, 'r') as file:
+        tuning = json.load(file)
+
+    if tuning.get('cpus') != available_cpus():
+        return {}
+
+    values = tuning.get(section, {})
+    if pinned:
+        values = {name: value for name, value in values.items() if not name.endswith('_THREADS')}
+    return values
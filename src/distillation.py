@@ -0,0 +1,36 @@
+import tensorflow as tf
+from tensorflow import keras
+
+@keras.saving.register_keras_serializable(package='iqa')
+class DistillationLoss(keras.losses.Loss):
+    """
+    MSE against a blend of ground truth and teacher targets.
+
+    y_true holds [mos, teacher score] per sample; alpha weighs the MOS term,
+    (1 - alpha) the teacher term.
+    """
+    def __init__(self, alpha=0.5, name='distillation_loss', **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.alpha = alpha
+
+    def call(self, y_true, y_pred):
+        y_true = tf.cast(y_true, y_pred.dtype)
+        mos_loss = tf.square(y_true[:, 0:1] - y_pred)
+        teacher_loss = tf.square(y_true[:, 1:2] - y_pred)
+        return tf.reduce_mean(self.alpha * mos_loss + (1.0 - self.alpha) * teacher_loss, axis=-1)
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({'alpha': self.alpha})
+        return config
+
+@keras.saving.register_keras_serializable(package='iqa')
+def mos_rmse(y_true, y_pred):
+    """RMSE against the MOS column only, comparable with the metrics of regular runs"""
+    y_true = tf.cast(y_true[:, 0:1], y_pred.dtype)
+    return tf.sqrt(tf.reduce_mean(tf.square(y_true - y_pred)))
+
+@keras.saving.register_keras_serializable(package='iqa')
+def mos_mae(y_true, y_pred):
+    y_true = tf.cast(y_true[:, 0:1], y_pred.dtype)
+    return tf.reduce_mean(tf.abs(y_true - y_pred))
@@ -0,0 +1,150 @@
+import os, json, hashlib, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.stats import rankdata, kendalltau
+
+SEED = 23478
+RESAMPLES = 2000
+CONFIDENCE = 0.95
+CHUNK_SIZE = 250
+
+METRICS = ('MAE', 'RMSE', 'EMD', 'PLCC', 'SRCC', 'KRCC')
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def list_hash(items):
+    digest = hashlib.sha256()
+    for item in items:
+        digest.update(os.path.basename(str(item)).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def _sidecar_path(predictions_path):
+    root, _ = os.path.splitext(predictions_path)
+    return f'{root}.json'
+
+def prediction_key(model_path, img_paths, **options):
+    """Identifies a prediction run: model file contents, the ordered image list and any scoring options"""
+    return {
+        'model_sha256': file_hash(model_path),
+        'images_sha256': list_hash(img_paths),
+        'options': options,
+    }
+
+def load_predictions(predictions_path, key):
+    """Cached predictions if they were made with the same key, otherwise None"""
+    sidecar = _sidecar_path(predictions_path)
+    if not os.path.isfile(predictions_path) or not os.path.isfile(sidecar):
+        return None
+
+    with open(sidecar, 'r') as file:
+        saved = json.load(file)
+
+    if any(saved.get(name) != value for name, value in key.items()):
+        return None
+    return np.load(predictions_path)
+
+def save_predictions(predictions_path, predictions, key, img_paths):
+    """Predictions go to .npy as before; the sidecar records the key and image names for later comparisons"""
+    np.save(predictions_path, predictions)
+    with open(_sidecar_path(predictions_path), 'w') as file:
+        json.dump(dict(key, images=[os.path.basename(str(path)) for path in img_paths]), file)
+
+def load_prediction_images(predictions_path):
+    with open(_sidecar_path(predictions_path), 'r') as file:
+        return json.load(file)['images']
+
+def _pearson(x, y):
+    """Row-wise correlation of two (resamples, n) arrays"""
+    x = x - x.mean(axis=1, keepdims=True)
+    y = y - y.mean(axis=1, keepdims=True)
+    return np.sum(x * y, axis=1) / np.sqrt(np.sum(x * x, axis=1) * np.sum(y * y, axis=1))
+
+def _resampled_metrics(mos, predictions, indices):
+    """(len(METRICS), resamples) for one model over a batch of resample index rows"""
+    x = mos[indices]
+    y = predictions[indices]
+    error = y - x
+
+    return np.stack([
+        np.mean(np.abs(error), axis=1),
+        np.sqrt(np.mean(np.square(error), axis=1)),
+        # both samples have the same size, so the 1d Wasserstein distance is the mean gap of the sorted samples
+        np.mean(np.abs(np.sort(x, axis=1) - np.sort(y, axis=1)), axis=1),
+        _pearson(x, y),
+        _pearson(rankdata(x, axis=1), rankdata(y, axis=1)),
+        # no vectorized O(n log n) form; this row loop dominates the cost and is what the process pool spreads
+        np.array([kendalltau(a, b)[0] for a, b in zip(x, y)]),
+    ])
+
+def _bootstrap_chunk(mos, predictions, seed, count):
+    rng = np.random.default_rng(seed)
+    indices = rng.integers(0, len(mos), size=(count, len(mos)))
+    return np.stack([_resampled_metrics(mos, p, indices) for p in predictions])
+
+def _bootstrap(mos, predictions, resamples, workers, seed):
+    """(models, len(METRICS), resamples); every model is scored on the same resamples, so they stay paired"""
+    mos = np.asarray(mos, dtype=np.float64)
+    predictions = [np.asarray(p, dtype=np.float64) for p in predictions]
+
+    counts = [CHUNK_SIZE] * (resamples // CHUNK_SIZE)
+    if resamples % CHUNK_SIZE:
+        counts.append(resamples % CHUNK_SIZE)
+    seeds = np.random.SeedSequence(seed).spawn(len(counts))
+
+    if workers == 1 or len(counts) == 1:
+        chunks = [_bootstrap_chunk(mos, predictions, s, c) for s, c in zip(seeds, counts)]
+    else:
+        # not forked: the caller may have tensorflow's threads running, which a fork copies in a broken state
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            chunks = list(pool.map(_bootstrap_chunk, [mos] * len(counts), [predictions] * len(counts), seeds, counts))
+
+    return np.concatenate(chunks, axis=-1)
+
+def _point_metrics(mos, predictions):
+    mos = np.asarray(mos, dtype=np.float64)
+    all_rows = np.arange(len(mos))[None, :]
+    return _resampled_metrics(mos, np.asarray(predictions, dtype=np.float64), all_rows)[:, 0]
+
+def bootstrap_ci(mos, predictions, resamples=RESAMPLES, confidence=CONFIDENCE, workers=None, seed=SEED):
+    """
+    {metric: (value, low, high)} with percentile bootstrap confidence intervals.
+    Predictions should already be mapped with metrics.fit_logistic; the mapping is not refitted per resample.
+    """
+    samples = _bootstrap(mos, [predictions], resamples, workers, seed)[0]
+    values = _point_metrics(mos, predictions)
+
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.nanpercentile(samples, [tail, 100 - tail], axis=-1)
+
+    return {name: (float(values[i]), float(low[i]), float(high[i])) for i, name in enumerate(METRICS)}
+
+def paired_bootstrap(mos, predictions_a, predictions_b, resamples=RESAMPLES, confidence=CONFIDENCE, workers=None, seed=SEED):
+    """
+    {metric: (a - b, low, high, p)} for two models scored on the same images.
+    Both are evaluated on identical resamples; p is the two-sided bootstrap p-value of the difference being zero.
+    """
+    samples = _bootstrap(mos, [predictions_a, predictions_b], resamples, workers, seed)
+    deltas = samples[0] - samples[1]
+    values = _point_metrics(mos, predictions_a) - _point_metrics(mos, predictions_b)
+
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.nanpercentile(deltas, [tail, 100 - tail], axis=-1)
+    p = 2 * np.minimum(np.nanmean(deltas <= 0, axis=-1), np.nanmean(deltas >= 0, axis=-1))
+
+    return {name: (float(values[i]), float(low[i]), float(high[i]), float(min(p[i], 1.0))) for i, name in enumerate(METRICS)}
+
+def print_ci(results, confidence=CONFIDENCE):
+    print(f"{'metric':<8}{'value':>10}{f'{confidence:.0%} CI':>24}")
+    for name, (value, low, high) in results.items():
+        print(f"{name:<8}{value:>10.4f}{f'[{low:.4f}, {high:.4f}]':>24}")
+
+def print_paired(results, confidence=CONFIDENCE):
+    print(f"{'metric':<8}{'a - b':>10}{f'{confidence:.0%} CI':>24}{'p':>8}")
+    for name, (delta, low, high, p) in results.items():
+        print(f"{name:<8}{delta:>10.4f}{f'[{low:.4f}, {high:.4f}]':>24}{p:>8.4f}")
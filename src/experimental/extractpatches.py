@@ -1,5 +1,43 @@
 import tensorflow as tf
 
+def extract_patches(inputs, grid_size):
+    """
+    Slices a 4d tensor into grid_size[0] x grid_size[1] equal patches, stacked along the channel dimension.
+    grid_size may hold tensors, so the grid can depend on the input shape.
+    """
+    shape = tf.shape(inputs)
+    batch_size = shape[0]
+    height = shape[1]
+    width = shape[2]
+    channels = shape[3]
+
+    patch_height = height // grid_size[0]
+    patch_width = width // grid_size[1]
+
+    size = [
+        batch_size, 
+        grid_size[0],
+        patch_height, 
+        grid_size[1],
+        patch_width, 
+        channels
+    ]
+    patches = tf.reshape(inputs, size)
+
+    # to (batch_size, patch_height, patch_width, grid_size[0], grid_size[1], channels)
+    patches = tf.transpose(patches, perm=[0, 2, 4, 1, 3, 5])
+
+    size = [
+        batch_size,
+        patch_height,
+        patch_width,
+        grid_size[0] * grid_size[1] * channels
+    ]
+    flattened = tf.reshape(patches, size)
+
+    return flattened
+
+
 class ExtractPatches(tf.keras.layers.Layer):
     """
     Custom layer that slices 4d tensor into equal-size patches along the 2nd and 3rd dimension.
@@ -14,37 +52,7 @@ class ExtractPatches(tf.keras.layers.Layer):
         self.grid_size = grid_size
 
     def call(self, inputs):
-        shape = tf.shape(inputs)
-        batch_size = shape[0]
-        height = shape[1]
-        width = shape[2]
-        channels = shape[3]
-
-        patch_height = height // self.grid_size[0]
-        patch_width = width // self.grid_size[1]
-
-        size = [
-            batch_size, 
-            self.grid_size[0],
-            patch_height, 
-            self.grid_size[1],
-            patch_width, 
-            channels
-        ]
-        patches = tf.reshape(inputs, size)
-
-        # to (batch_size, patch_height, patch_width, grid_size[0], grid_size[1], channels)
-        patches = tf.transpose(patches, perm=[0, 2, 4, 1, 3, 5])
-
-        size = [
-            batch_size,
-            patch_height,
-            patch_width,
-            self.grid_size[0] * self.grid_size[1] * channels
-        ]
-        flattened = tf.reshape(patches, size)
-
-        return flattened
+        return extract_patches(inputs, self.grid_size)
 
     def compute_output_shape(self, input_shape):
         batch_size = input_shape[0]
@@ -1,53 +1,69 @@
 import tensorflow as tf
 
-def _compute_histogram(values, value_range, nbins=256):
-    """XLA-compatible impl of tf.histogram_fixed_width()"""
-
+def _bin_ids(values, value_range, nbins):
+    # bin edges need full precision, bfloat16 cannot tell 256 bins apart
+    values = tf.cast(values, tf.float32)
     min_val, max_val = value_range
-    
+
     bin_width = tf.maximum(
-        (max_val - min_val) / tf.cast(nbins, values.dtype), 
+        (max_val - min_val) / tf.cast(nbins, values.dtype),
         tf.keras.backend.epsilon()
     )
-    
+
     bins = tf.floor((values - min_val) / bin_width)
-    bins = tf.cast(tf.clip_by_value(bins, 0, nbins - 1), tf.int32)
-    
-    encoded = tf.one_hot(bins, depth=nbins, dtype=tf.int32)
-    histogram = tf.reduce_sum(encoded, axis=0)
-    
-    return histogram
+    return tf.cast(tf.clip_by_value(bins, 0, nbins - 1), tf.int32)
+
+def _batched_histograms(values, value_range, nbins=256):
+    """
+    Histograms of every (row, channel) pair of a [rows, samples, channels] tensor in one pass.
+
+    Each value is mapped to a flat (row, channel, bin) id and counted with a single segment sum,
+    so no one-hot tensor is materialized. XLA-compatible. Returns float32 counts of shape [rows, channels, nbins].
+    """
+    shape = tf.shape(values)
+    rows, channels = shape[0], shape[2]
+
+    bins = _bin_ids(values, value_range, nbins)
+
+    row_ids = tf.range(rows)[:, tf.newaxis, tf.newaxis]
+    channel_ids = tf.range(channels)[tf.newaxis, tf.newaxis, :]
+    ids = (row_ids * channels + channel_ids) * nbins + bins
+
+    counts = tf.math.unsorted_segment_sum(
+        tf.ones_like(ids, dtype=tf.float32),
+        tf.reshape(ids, [-1]),
+        num_segments=rows * channels * nbins
+    )
+    return tf.reshape(counts, [rows, channels, nbins])
+
+def _compute_histogram(values, value_range, nbins=256):
+    """XLA-compatible impl of tf.histogram_fixed_width()"""
+    counts = _batched_histograms(tf.reshape(values, [1, -1, 1]), value_range, nbins)
+    return tf.cast(tf.reshape(counts, [nbins]), tf.int32)
 
 class NormalizedHistogram(tf.keras.layers.Layer):
     """Custom histogram layer that outputs normalized info
 
     This layer can work with images of any dimensions and any number of channels,
     provided that it is in the 'channels-last' format.
+    All images and channels of a batch are computed together.
     """
     def __init__(self, nbins=256, **kwargs):
         super().__init__(**kwargs)
         self.nbins = nbins
 
     def call(self, inputs):
+        shape = tf.shape(inputs)
+        flattened = tf.reshape(inputs, [shape[0], -1, shape[3]])
 
-        def op_per_channel(channel):
-            flattened = tf.reshape(channel, [-1])
-
-            hist = _compute_histogram(flattened, value_range=[0.0, 1.0], nbins=self.nbins + 1)
-            hist = tf.cast(hist, tf.float32)
-            hist = hist[1:]  # Remove the first bin to remove impact of zero-padding
-
-            # prevent div by 0 when channel is empty
-            denom = tf.maximum(tf.reduce_sum(hist), tf.keras.backend.epsilon())
-            return hist / denom
+        hist = _batched_histograms(flattened, value_range=[0.0, 1.0], nbins=self.nbins + 1)
+        hist = hist[:, :, 1:]  # Remove the first bin to remove impact of zero-padding
 
-        def op_per_image(image):
-            channels_first = tf.transpose(image, perm=[2, 0, 1])
-            histograms = tf.map_fn(op_per_channel, channels_first, dtype=tf.float32)
-            return tf.transpose(histograms, perm=[1, 0])
+        # prevent div by 0 when channel is empty
+        denom = tf.maximum(tf.reduce_sum(hist, axis=-1, keepdims=True), tf.keras.backend.epsilon())
+        hist = hist / denom
 
-        histograms = tf.map_fn(op_per_image, inputs, dtype=tf.float32)
-        return histograms
+        return tf.transpose(hist, perm=[0, 2, 1])
 
     def compute_output_shape(self, input_shape):
         samples, height, width, channels = input_shape
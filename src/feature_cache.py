@@ -0,0 +1,185 @@
+import os, json, hashlib, tempfile, contextlib
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from cli import lazy_import
+
+tf = lazy_import('tensorflow')
+
+INDEX_NAME = 'index.json'
+LOCK_NAME = '.lock'
+
+# full precision, so the head trains on exactly the features the assembled model feeds it;
+# part of the store directory name, so stores written with another dtype are never misread
+DTYPE = np.float32
+
+def crop_key(height, width, model_height, model_width, precision):
+    """Cache key part describing how images were cropped and which precision the extractor ran in"""
+    return f'{height}x{width}-center-{model_height}x{model_width}-{precision}'
+
+def weights_hash(model):
+    sha = hashlib.sha1()
+    for weight in model.weights:
+        sha.update(weight.numpy().tobytes())
+    return sha.hexdigest()
+
+class FeatureCache:
+    """
+    On-disk store of frozen backbone outputs, one memory-mapped array per extractor output.
+
+    Every row is keyed by image path and crop parameters, and the whole store lives
+    in a subdirectory named after the extractor weights hash, so changing the backbone
+    weights never serves stale features.
+
+    A store may be shared by concurrent runs: fill() holds an exclusive lock on it and re-reads the index,
+    so rows are only ever appended, and the arrays are grown but never shrunk.
+    """
+    def __init__(self, store_dir, shapes, crop_key, extractor=None, readonly=False):
+        self.extractor = extractor
+        self.crop_key = crop_key
+        self.shapes = [tuple(shape) for shape in shapes]
+        self.readonly = readonly
+
+        self.dir = store_dir
+        os.makedirs(self.dir, exist_ok=True)
+
+        if readonly:
+            self._load_index()
+            self.arrays = self._open_arrays(self.rows)
+        else:
+            # growing the arrays must not race another run's fill
+            with self._locked():
+                self._load_index()
+                self.arrays = self._open_arrays(self.rows)
+
+    @classmethod
+    def for_extractor(cls, cache_dir, extractor, crop_key):
+        """Store of the given extractor's outputs, in a subdirectory named after its weights hash and the stored dtype"""
+        shapes = [tuple(output.shape[1:]) for output in extractor.outputs]
+        store_dir = os.path.join(cache_dir, f'{weights_hash(extractor)[:16]}-{np.dtype(DTYPE).name}')
+        return cls(store_dir, shapes, crop_key, extractor=extractor)
+
+    def _key(self, path):
+        return f'{path}|{self.crop_key}'
+
+    def _array_path(self, i):
+        return os.path.join(self.dir, f'features_{i}.dat')
+
+    def _open_arrays(self, rows):
+        arrays = []
+        for i, shape in enumerate(self.shapes):
+            path = self._array_path(i)
+            size = rows * int(np.prod(shape)) * np.dtype(DTYPE).itemsize
+
+            # rows past the index, from an interrupted fill, are kept and overwritten by the next one
+            if not self.readonly and (not os.path.isfile(path) or os.path.getsize(path) < size):
+                with open(path, 'ab') as file:
+                    file.truncate(size)
+
+            if rows == 0:
+                arrays.append(np.zeros((0, *shape), dtype=DTYPE))
+            else:
+                mode = 'r' if self.readonly else 'r+'
+                arrays.append(np.memmap(path, dtype=DTYPE, mode=mode, shape=(rows, *shape)))
+        return arrays
+
+    def _load_index(self):
+        self.index = {}
+        index_path = os.path.join(self.dir, INDEX_NAME)
+        if os.path.isfile(index_path):
+            with open(index_path, 'r') as file:
+                self.index = json.load(file)
+        self.rows = len(self.index)
+
+    def _save_index(self):
+        index_path = os.path.join(self.dir, INDEX_NAME)
+        with tempfile.NamedTemporaryFile('w', dir=self.dir, suffix='.tmp', delete=False) as file:
+            json.dump(self.index, file)
+        os.replace(file.name, index_path)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Exclusive lock on the store across processes, held from reading the index to saving it"""
+        with open(os.path.join(self.dir, LOCK_NAME), 'w') as handle:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            yield
+
+    def missing(self, paths):
+        return [path for path in paths if self._key(path) not in self.index]
+
+    def fill(self, paths, load_fn, batch_size=32):
+        """Runs the extractor once over every path that is not cached yet"""
+        missing = self.missing(paths)
+        if len(missing) == 0:
+            return 0
+
+        if self.readonly or self.extractor is None:
+            raise ValueError(f"Feature cache at {self.dir} is missing {len(missing)} images and cannot be filled")
+
+        with self._locked():
+            return self._fill_locked(paths, load_fn, batch_size)
+
+    def _fill_locked(self, paths, load_fn, batch_size):
+        # another run may have added rows, possibly some of these images, since this one read the index
+        self._load_index()
+        missing = self.missing(paths)
+
+        start = self.rows
+        for arr in self.arrays:
+            if isinstance(arr, np.memmap):
+                arr.flush()
+        self.arrays = self._open_arrays(start + len(missing))
+
+        if len(missing) == 0:
+            return 0
+
+        dataset = (tf.data.Dataset.from_tensor_slices(missing)
+            .map(load_fn, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+            .batch(batch_size)
+            .prefetch(tf.data.experimental.AUTOTUNE)
+        )
+
+        row = start
+        for batch in dataset:
+            outputs = self.extractor(batch, training=False)
+            n = int(outputs[0].shape[0])
+            for arr, output in zip(self.arrays, outputs):
+                arr[row:row + n] = output.numpy().astype(DTYPE)
+            row += n
+
+        for arr in self.arrays:
+            arr.flush()
+
+        for i, path in enumerate(missing):
+            self.index[self._key(path)] = start + i
+        self.rows = start + len(missing)
+        self._save_index()
+
+        return len(missing)
+
+    def lookup(self, paths):
+        return np.array([self.index[self._key(path)] for path in paths], dtype=np.int64)
+
+    def read(self, rows):
+        order = np.argsort(rows)
+        inverse = np.argsort(order)
+        # sorted reads are sequential on the memmap
+        return [np.asarray(arr[rows[order]][inverse], dtype=np.float32) for arr in self.arrays]
+
+    def dataset(self, rows, mos, batch_size):
+        """Batched tf.data pipeline yielding ((features...), mos) in the given row order, read straight from the memmaps"""
+        def read_batch(batch_rows, batch_mos):
+            features = tf.numpy_function(self.read, [batch_rows], [tf.float32] * len(self.shapes))
+            for feature, shape in zip(features, self.shapes):
+                feature.set_shape((None, *shape))
+            return tuple(features), batch_mos
+
+        return (tf.data.Dataset.from_tensor_slices((rows, mos))
+            .batch(batch_size)
+            .map(read_batch, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        )
@@ -0,0 +1,158 @@
+import os, json
+import tensorflow as tf
+import numpy as np
+
+import images
+
+INDEX_NAME = 'index.json'
+SHARD_SIZE = 1024
+READ_BLOCK = 256
+
+def cache_path(cache_root, image_dir, height, width):
+    return f'{cache_root}/{os.path.basename(os.path.normpath(image_dir))}_{height}x{width}'
+
+def _shard_name(i):
+    return f'shard_{i:05}.npy'
+
+def build(image_dir, out_dir, height, width, shard_size=SHARD_SIZE, batch_size=64):
+    """Decodes and resizes every image in image_dir once and writes uint8 .npy shards plus an index"""
+    os.makedirs(out_dir, exist_ok=True)
+
+    paths = images.get_image_list(image_dir)
+    names = [os.path.basename(path) for path in paths]
+
+    def load(path):
+        image = images.load_image(path, height, width)
+        return tf.cast(tf.clip_by_value(tf.round(image), 0, 255), tf.uint8)
+
+    dataset = (tf.data.Dataset.from_tensor_slices(paths)
+        .map(load, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        .batch(batch_size)
+        .prefetch(tf.data.experimental.AUTOTUNE)
+    )
+
+    shards = []
+    shard, row = None, 0
+    for batch in dataset:
+        batch = batch.numpy()
+        i = 0
+        while i < len(batch):
+            if shard is None:
+                rows = min(shard_size, len(paths) - sum(shards))
+                shard_file = os.path.join(out_dir, _shard_name(len(shards)))
+                shard = np.lib.format.open_memmap(shard_file, mode='w+', dtype=np.uint8, shape=(rows, height, width, 3))
+                shards.append(rows)
+                row = 0
+
+            n = min(len(batch) - i, len(shard) - row)
+            shard[row:row + n] = batch[i:i + n]
+            row += n
+            i += n
+
+            if row == len(shard):
+                shard.flush()
+                shard = None
+
+    index = {
+        'height': height,
+        'width': width,
+        'files': names,
+        'shards': shards,
+    }
+    with open(os.path.join(out_dir, INDEX_NAME), 'w') as file:
+        json.dump(index, file)
+
+    return len(names)
+
+def exists(cache_dir):
+    return os.path.isfile(os.path.join(cache_dir, INDEX_NAME))
+
+class ImageCache:
+    """
+    Read side of the preprocessed image cache.
+
+    Shards are opened as read-only memmaps, so only the rows that are actually read get paged in.
+    """
+    def __init__(self, cache_dir):
+        with open(os.path.join(cache_dir, INDEX_NAME), 'r') as file:
+            index = json.load(file)
+
+        self.height = index['height']
+        self.width = index['width']
+        self.rows = {name: i for i, name in enumerate(index['files'])}
+
+        self.shards = [np.load(os.path.join(cache_dir, _shard_name(i)), mmap_mode='r') for i in range(len(index['shards']))]
+        self.offsets = np.cumsum([0] + index['shards'])
+
+    def covers(self, paths, height, width):
+        """Whether every image in paths is cached, at height x width"""
+        if (self.height, self.width) != (height, width):
+            return False
+        return all(os.path.basename(path) in self.rows for path in paths)
+
+    def lookup(self, paths):
+        """Global row ids for image paths; raises KeyError for images missing from the cache"""
+        return np.array([self.rows[os.path.basename(path)] for path in paths], dtype=np.int64)
+
+    def read(self, rows):
+        out = np.empty((len(rows), self.height, self.width, 3), dtype=np.uint8)
+        shard_ids = np.searchsorted(self.offsets, rows, side='right') - 1
+        for shard_id in np.unique(shard_ids):
+            mask = shard_ids == shard_id
+            out[mask] = self.shards[shard_id][rows[mask] - self.offsets[shard_id]]
+        return out
+
+    def _read_block(self, block_rows, block_labels):
+        block = tf.numpy_function(self.read, [block_rows], tf.uint8)
+        block.set_shape((None, self.height, self.width, 3))
+        return block, block_labels
+
+    @staticmethod
+    def _to_float(image, label):
+        return tf.cast(image, tf.float32), label
+
+    def dataset(self, rows, labels):
+        """Unbatched (float32 image, label) pairs in the given row order, read from the shards in blocks"""
+        return (tf.data.Dataset.from_tensor_slices((rows, labels))
+            .batch(READ_BLOCK)
+            .map(self._read_block, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+            .unbatch()
+            .map(self._to_float)
+        )
+
+    def shuffled_dataset(self, rows, labels, seed, buffer_size, cycle_length=4):
+        """
+        Unbatched (float32 image, label) pairs in an order reproducible from `seed`, a [2] int64 tensor.
+
+        The shard order is permuted, `cycle_length` shards are read sequentially and interleaved,
+        and the images are mixed in a local shuffle buffer. Memory is O(buffer_size), not O(dataset).
+        """
+        rows = np.asarray(rows)
+        labels = np.asarray(labels)
+
+        # group rows by shard, sequential within a shard
+        order = np.argsort(rows, kind='stable')
+        rows, labels = rows[order], labels[order]
+        shard_ids = np.searchsorted(self.offsets, rows, side='right') - 1
+        bounds = np.searchsorted(shard_ids, np.arange(len(self.shards) + 1))
+
+        rows = tf.constant(rows)
+        labels = tf.constant(labels)
+        bounds = tf.constant(bounds, dtype=tf.int64)
+
+        def read_shard(shard):
+            start, end = bounds[shard], bounds[shard + 1]
+            return (tf.data.Dataset.from_tensor_slices((rows[start:end], labels[start:end]))
+                .batch(READ_BLOCK)
+                .map(self._read_block)
+            )
+
+        shard_order = tf.random.experimental.stateless_shuffle(tf.range(len(self.shards), dtype=tf.int64), seed=seed)
+        buffer_seed = seed[0] * 1000003 + seed[1]
+
+        return (tf.data.Dataset.from_tensor_slices(shard_order)
+            .interleave(read_shard, cycle_length=cycle_length, num_parallel_calls=tf.data.experimental.AUTOTUNE, deterministic=True)
+            .unbatch()
+            .shuffle(buffer_size, seed=buffer_seed)
+            .map(self._to_float)
+        )
@@ -6,16 +6,32 @@ SEED = 23478
 tf.random.set_seed(SEED)
 random.seed(SEED)
 
-def load_image(path, height, width):
-    image = tf.io.read_file(path)
-    image = tf.image.decode_jpeg(image, channels=3)
+def decode_image(data, height, width):
+    image = tf.image.decode_jpeg(data, channels=3)
     image = tf.image.resize(image, [height, width])
     return image
 
+def load_full_image(path):
+    image = tf.io.read_file(path)
+    image = tf.image.decode_jpeg(image, channels=3)
+    return tf.cast(image, tf.float32)
+
+def load_image(path, height, width):
+    image = tf.io.read_file(path)
+    return decode_image(image, height, width)
+
+def load_center_cropped(path, height, width, crop_height, crop_width):
+    image = load_image(path, height, width)
+    return center_crop_image(image, crop_height, crop_width)
+
 def random_crop_image(image, height, width):
     image = tf.image.random_crop(image, [height, width, 3], seed=SEED)
     return image
 
+def center_crop_image(image, height, width):
+    image = tf.image.resize_with_crop_or_pad(image, height, width)
+    return image
+
 def get_image_list(dir_path):
     filenames = np.sort(np.array(os.listdir(dir_path)))
     return dir_path + "/" + filenames
@@ -0,0 +1,80 @@
+import math
+import tensorflow as tf
+from tensorflow import keras
+
+# tensors larger than this are histogrammed from an evenly strided sample; norms always use the full tensor
+SAMPLE_SIZE = 16384
+
+class InstrumentationCallback(keras.callbacks.Callback):
+    """
+    Weight histograms and summary statistics of the trainable variables, every `freq` epochs:
+    - <variable>/histogram over at most `sample_size` strided values
+    - <variable>/norm and <variable>/update_ratio, |w - w_prev| / |w_prev| since the last logged epoch
+    - <layer>/dead_relu, the fraction of relu units that output zero for the whole probe batch
+
+    Everything is computed in one compiled function on the device, with no per-layer host copies;
+    the summary writer flushes in the background. Frozen backbone variables are skipped.
+    Replaces TensorBoard's histogram_freq, which should be left at 0.
+    """
+    def __init__(self, log_dir, freq=1, sample_size=SAMPLE_SIZE, probe=None):
+        super().__init__()
+        self.freq = freq
+        self.sample_size = sample_size
+        self.probe = probe
+        self.writer = tf.summary.create_file_writer(log_dir)
+        self._built_for = None
+
+    def set_model(self, model):
+        super().set_model(model)
+
+        # fit() sets the model again on every call; keep the snapshots, so the first update_ratio
+        # of the next fit still compares against the last logged epoch rather than its own start
+        if model is self._built_for:
+            return
+        self._built_for = model
+
+        self._variables = list(model.trainable_weights)
+        self._previous = [tf.Variable(v, trainable=False) for v in self._variables]
+
+        relu_layers = [layer for layer in model.layers if getattr(layer, 'activation', None) is keras.activations.relu]
+        self._relu_names = [layer.name for layer in relu_layers]
+        self._relu_model = None
+        if self.probe is not None and relu_layers:
+            self._relu_model = keras.Model(inputs=model.inputs, outputs=[layer.output for layer in relu_layers])
+
+        self._log = tf.function(self._summaries)
+
+    def _sample(self, variable):
+        flat = tf.reshape(tf.cast(variable, tf.float32), [-1])
+        size = flat.shape[0]
+        if size > self.sample_size:
+            flat = flat[::math.ceil(size / self.sample_size)]
+        return flat
+
+    def _summaries(self, step):
+        with self.writer.as_default(step=step):
+            for variable, previous in zip(self._variables, self._previous):
+                name = getattr(variable, 'path', variable.name)
+                current = tf.cast(variable, tf.float32)
+                norm = tf.norm(current)
+
+                tf.summary.histogram(f'{name}/histogram', self._sample(variable))
+                tf.summary.scalar(f'{name}/norm', norm)
+                tf.summary.scalar(f'{name}/update_ratio', tf.norm(current - previous) / tf.maximum(tf.norm(previous), 1e-12))
+                previous.assign(current)
+
+            if self._relu_model is not None:
+                outputs = self._relu_model(self.probe, training=False)
+                if not isinstance(outputs, (list, tuple)):
+                    outputs = [outputs]
+                for name, output in zip(self._relu_names, outputs):
+                    dead = tf.reduce_all(tf.reshape(output, [tf.shape(output)[0], -1]) <= 0, axis=0)
+                    tf.summary.scalar(f'{name}/dead_relu', tf.reduce_mean(tf.cast(dead, tf.float32)))
+
+    def on_epoch_end(self, epoch, logs=None):
+        if (epoch + 1) % self.freq != 0:
+            return
+        self._log(tf.constant(epoch, tf.int64))
+
+    def on_train_end(self, logs=None):
+        self.writer.flush()
@@ -1,19 +1,65 @@
-import csv, os
+import csv, os, tempfile
 import numpy as np
 
-def _load_data(mos_path, image_dir):
+def _index_path(mos_path):
+    root, _ = os.path.splitext(mos_path)
+    return f'{root}.index.npz'
+
+def _read_index(mos_path):
+    """Returns (names, mos) sorted by name, reusing a binary sidecar while the csv is unchanged"""
+    stat = os.stat(mos_path)
+    index_path = _index_path(mos_path)
+
+    if os.path.isfile(index_path):
+        with np.load(index_path) as index:
+            if index['mtime_ns'] == stat.st_mtime_ns and index['size'] == stat.st_size:
+                return index['names'], index['mos']
+
     with open(mos_path, "r") as csv_file:
         reader = csv.reader(csv_file)
-        parsed_data = [row for row in reader]
+        next(reader, None)
+        parsed_data = [(row[0], row[1]) for row in reader]
+
+    names = np.array([row[0] for row in parsed_data])
+    mos = np.array([row[1] for row in parsed_data]).astype(np.float32)
+
+    order = np.argsort(names, kind='stable')
+    names, mos = names[order], mos[order]
+
+    # written under a unique name and renamed, since workers sharing the data directory may build it at once
+    # and a reader must never load a half-written index
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(index_path) or '.', suffix='.tmp', delete=False) as file:
+            tmp_path = file.name
+            np.savez(file, names=names, mos=mos, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
-    rows = np.array(parsed_data[1:])
-    rows = rows[np.argsort(rows[:, 0])]
+    return names, mos
 
-    imgpaths = sorted(os.listdir(image_dir))
-    filtered_rows = np.array([row for row in rows if row[0] in imgpaths])
+def _join(mos_path, image_dir):
+    names, mos = _read_index(mos_path)
+
+    filenames = np.sort(np.array(os.listdir(image_dir)))
+    if len(names) == 0 or len(filenames) == 0:
+        return np.array([], dtype=str), np.array([], dtype=np.float32)
+
+    pos = np.searchsorted(names, filenames)
+    pos = np.minimum(pos, len(names) - 1)
+    found = names[pos] == filenames
+
+    return image_dir + "/" + filenames[found], mos[pos[found]]
+
+def _load_data(mos_path, image_dir):
+    _, mos = _join(mos_path, image_dir)
+    return mos
 
-    mos = filtered_rows[:, 1]
-    return mos.astype(np.float32)
+def load_labeled_images(mos_path, image_dir):
+    """Image paths and their continuous labels, aligned; images without a label are skipped"""
+    return _join(mos_path, image_dir)
 
 def load_ordinal(mos_path, image_dir):
     mos = _load_data(mos_path, image_dir)
@@ -0,0 +1,28 @@
+import numpy as np
+from scipy.optimize import curve_fit
+from scipy.stats import pearsonr, spearmanr, kendalltau, wasserstein_distance
+
+def logistic_function(y, beta1, beta2, beta3, beta4, beta5):
+    out = beta1 * (0.5 - 1 / (1 + np.exp(beta2 * (y - beta3)))) + beta4 * y + beta5
+    return out.astype(np.float32)
+
+def fit_logistic(predictions, mos):
+    """Maps raw predictions onto the MOS scale, as is standard before computing PLCC"""
+    params, covariance = curve_fit(logistic_function, predictions, mos, p0=[1, 1, 1, 1, 1])
+    return params, logistic_function(predictions, *params)
+
+def compute_metrics(mos, predictions):
+    error = predictions - mos
+    return {
+        'MAE': float(np.mean(np.abs(error))),
+        'MSE': float(np.mean(np.square(error))),
+        'RMSE': float(np.sqrt(np.mean(np.square(error)))),
+        'EMD': float(wasserstein_distance(mos, predictions)),
+        'PLCC': float(pearsonr(mos, predictions)[0]),
+        'SRCC': float(spearmanr(mos, predictions)[0]),
+        'KRCC': float(kendalltau(mos, predictions)[0]),
+    }
+
+def print_metrics(results):
+    for name, value in results.items():
+        print(f'{name}: {value:.4f}')
@@ -0,0 +1,60 @@
+import os, json, math
+
+def sidecar_path(model_path):
+    root, _ = os.path.splitext(model_path)
+    return f'{root}.json'
+
+def _name(obj):
+    return getattr(obj, 'name', None) or getattr(obj, '__name__', None) or obj.__class__.__name__
+
+def describe(model):
+    """Metadata tools need without loading the archive"""
+    optimizer = getattr(model, 'optimizer', None)
+    loss = getattr(model, 'loss', None)
+
+    return {
+        'name': model.name,
+        'input_shape': model.input_shape,
+        'output_shape': model.output_shape,
+        'dtype_policy': model.dtype_policy.name,
+        'layers': len(model.layers),
+        'hidden_layers': len(model.layers) - 2,
+        'total_params': int(model.count_params()),
+        'trainable_params': int(sum(math.prod(v.shape) for v in model.trainable_weights)),
+        'loss': _name(loss) if loss is not None else None,
+        'metrics': [metric.name for metric in model.metrics],
+        'optimizer': {
+            'class': optimizer.__class__.__name__,
+            'config': optimizer.get_config(),
+        } if optimizer is not None else None,
+    }
+
+def _archive_stat(model_path):
+    stat = os.stat(model_path)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+def write(model, model_path):
+    """Call after saving the archive: the sidecar records which archive file it describes"""
+    path = sidecar_path(model_path)
+    info = dict(describe(model), archive=_archive_stat(model_path))
+
+    # write-and-rename, so a reader never sees a truncated sidecar
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(info, file, indent=4, default=str)
+    os.replace(tmp_path, path)
+
+def read(model_path):
+    """
+    Metadata saved alongside the model, or None if there is no sidecar or it describes another version
+    of the archive, e.g. one saved before sidecars existed or overwritten without one
+    """
+    path = sidecar_path(model_path)
+    if not os.path.isfile(path) or not os.path.isfile(model_path):
+        return None
+    with open(path, 'r') as file:
+        info = json.load(file)
+
+    if info.get('archive') != _archive_stat(model_path):
+        return None
+    return info
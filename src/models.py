@@ -4,24 +4,50 @@ from tensorflow import keras
 from tensorflow.keras import layers
 from tensorflow.keras.regularizers import l2
 
-from nima import load_pretrained_nima
+import checkpoints, model_info
+from distillation import DistillationLoss, mos_rmse, mos_mae
 
 SEED = 23478
 tf.random.set_seed(SEED)
 random.seed(SEED)
 
 DROPOUT_DENSE = 0.5
+LEARNING_RATE = 5e-4
+DECAY_LEARNING_RATE = 1e-4
+DECAY_STEPS = 1000
+DECAY_RATE = 0.9
 ACT_DENSE = 'relu'
 ACT_CNN = 'leaky_relu'
 L2_DENSE = l2(1e-3)
 L2_CNN = l2(1e-6)
 
-def _dense_blocks(input_layer, units):
+BF16_CPU_FLAGS = ('amx_bf16', 'avx512_bf16')
+
+def resolve_precision(precision):
+    """'auto' picks mixed_bfloat16 on CPUs with native bf16 support, float32 elsewhere"""
+    if precision != 'auto':
+        return precision
+
+    try:
+        with open('/proc/cpuinfo', 'r') as file:
+            flags = file.read().split()
+    except OSError:
+        return 'float32'
+
+    return 'mixed_bfloat16' if any(flag in flags for flag in BF16_CPU_FLAGS) else 'float32'
+
+def set_precision(precision):
+    """Sets the global Keras dtype policy; affects only models built afterwards"""
+    precision = resolve_precision(precision)
+    keras.mixed_precision.set_global_policy(precision)
+    return precision
+
+def _dense_blocks(input_layer, units, dropout=DROPOUT_DENSE):
     x = input_layer
     for u in units:
         x = layers.Dense(units=u, activation=ACT_DENSE, kernel_regularizer=L2_DENSE)(x)
         x = layers.BatchNormalization()(x)
-        x = layers.Dropout(DROPOUT_DENSE, seed=SEED)(x)
+        x = layers.Dropout(dropout, seed=SEED)(x)
     return x
 
 def _multi_channel_attention(input):
@@ -64,25 +90,29 @@ def _adaptive_average_pool_2D(x, target_shape):
 
     return layers.AveragePooling2D(pool_size=pool_size, strides=pool_size, padding="valid")(x)
 
-def _hidden_layers(input_layer):
-
-    # nima route
-    nima = load_pretrained_nima()
+def _nima_route(input_layer, trainable=False, pretrained=True):
+    # the vendored builder is only needed to build new models, not to load saved ones
+    from nima import load_pretrained_nima
+    nima = load_pretrained_nima(load_weights=pretrained)
 
     nima = keras.Model(inputs=nima.input, outputs=nima.layers[-3].output, name="nima_backbone")
 
     for layer in nima.layers:
-        layer.trainable = False
+        layer.trainable = trainable
 
     # [0,255] -> [-1,1]
     n = layers.Rescaling(scale=1.0/127.5, offset=-1.0)(input_layer)
-    n = nima(n)
-    n = _dense_blocks(n, [256, 128, 64])
+    return nima(n)
+
+def _backbones(input_layer, freeze_effnet=False, pretrained=True):
+
+    # nima route
+    n = _nima_route(input_layer, pretrained=pretrained)
 
     # conv route
     effnet = tf.keras.applications.EfficientNetV2B0(
         include_top=False,
-        weights='imagenet',
+        weights='imagenet' if pretrained else None,
         input_shape=(224, 224, 3),
         include_preprocessing=True
     )
@@ -100,10 +130,19 @@ def _hidden_layers(input_layer):
 
     effnet = tf.keras.models.Model(inputs=effnet.input, outputs=output_layers, name='efficient_net_v2_backbone')
 
+    if freeze_effnet:
+        effnet.trainable = False
+
     cc = effnet(input_layer)
     cc = [_adaptive_average_pool_2D(c, (7,7)) for c in cc]
 
     c = layers.Concatenate(axis=-1)(cc)
+
+    return n, c
+
+def _head(n, c, dropout=DROPOUT_DENSE):
+    n = _dense_blocks(n, [256, 128, 64], dropout)
+
     c_channels = keras.backend.int_shape(c)[-1]
 
     c = layers.Conv2D(c_channels // 4, (1,1), padding='same', activation=ACT_CNN, kernel_regularizer=L2_CNN)(c)
@@ -116,34 +155,41 @@ def _hidden_layers(input_layer):
     c = _multi_channel_attention(c)
     c = layers.GlobalAveragePooling2D()(c)
 
-    c = _dense_blocks(c, [256, 128, 64])
+    c = _dense_blocks(c, [256, 128, 64], dropout)
 
     # merge
     x = layers.Concatenate()([n, c])
-    x = _dense_blocks(x, [1024, 128])
+    x = _dense_blocks(x, [1024, 128], dropout)
 
     return x
 
-def init_model_continuous(height, width):
-    input_layer = layers.Input(shape=(height, width, 3))
-    hidden_layers = _hidden_layers(input_layer)
-    output_layer = layers.Dense(units=1, activation='linear')(hidden_layers)
-
-    model = keras.Model(inputs=input_layer, outputs=output_layer)
-
-    initial_learning_rate = 1e-4  # Start higher
-    decay_steps = 1000
-    decay_rate = 0.9
-
-    lr_schedule = tf.keras.optimizers.schedules.ExponentialDecay(
-        initial_learning_rate,
-        decay_steps=decay_steps,
-        decay_rate=decay_rate,
+def _hidden_layers(input_layer, pretrained=True):
+    n, c = _backbones(input_layer, pretrained=pretrained)
+    return _head(n, c)
+
+def _decay_schedule(accumulation_steps=1):
+    """
+    The optimizer's iteration counter advances on every micro-batch, also while only accumulating,
+    so decay_steps is scaled to keep the schedule counting applied updates
+    """
+    return keras.optimizers.schedules.ExponentialDecay(
+        DECAY_LEARNING_RATE,
+        decay_steps=DECAY_STEPS * accumulation_steps,
+        decay_rate=DECAY_RATE,
         staircase=True
     )
 
+def _adam(learning_rate=LEARNING_RATE, accumulation_steps=1):
+    """accumulation_steps > 1 averages gradients over that many micro-batches before each Adam update"""
+    return keras.optimizers.Adam(
+        learning_rate=learning_rate,
+        gradient_accumulation_steps=accumulation_steps if accumulation_steps > 1 else None
+    )
+
+def _compile_continuous(model, jit_compile=False, learning_rate=LEARNING_RATE, accumulation_steps=1):
     model.compile(
-        optimizer=keras.optimizers.Adam(learning_rate=5e-4),
+        jit_compile=jit_compile,
+        optimizer=_adam(learning_rate, accumulation_steps),
         loss=keras.losses.MeanSquaredError(),
         metrics=[
             keras.metrics.RootMeanSquaredError(),
@@ -151,16 +197,99 @@ def init_model_continuous(height, width):
         ]
     )
 
+def init_model_continuous(height, width, jit_compile=False, pretrained=True, accumulation_steps=1, lr_decay=False):
+    """
+    pretrained=False skips loading backbone weights, e.g. for benchmarks.
+    accumulation_steps trains with an effective batch that many times the fed batch, at the memory cost of one.
+    lr_decay replaces the constant learning rate with an exponential decay over optimizer updates.
+    """
+    input_layer = layers.Input(shape=(height, width, 3))
+    hidden_layers = _hidden_layers(input_layer, pretrained)
+    output_layer = layers.Dense(units=1, activation='linear', dtype='float32')(hidden_layers)
+
+    model = keras.Model(inputs=input_layer, outputs=output_layer)
+
+    learning_rate = _decay_schedule(accumulation_steps) if lr_decay else LEARNING_RATE
+    _compile_continuous(model, jit_compile, learning_rate, accumulation_steps)
+
+    return model
+
+def init_feature_extractor(height, width):
+    """Frozen backbones only; outputs [nima embedding, pooled effnet features]"""
+    input_layer = layers.Input(shape=(height, width, 3))
+    n, c = _backbones(input_layer, freeze_effnet=True)
+
+    extractor = keras.Model(inputs=input_layer, outputs=[n, c], name='feature_extractor')
+    extractor.trainable = False
+    return extractor
+
+def init_head_continuous(feature_shapes, jit_compile=False, learning_rate=LEARNING_RATE, dropout=DROPOUT_DENSE, accumulation_steps=1):
+    """Trainable part of the continuous model, fed with cached backbone features"""
+    inputs = [layers.Input(shape=shape) for shape in feature_shapes]
+    hidden_layers = _head(*inputs, dropout=dropout)
+    output_layer = layers.Dense(units=1, activation='linear', dtype='float32')(hidden_layers)
+
+    head = keras.Model(inputs=inputs, outputs=output_layer, name='head')
+    _compile_continuous(head, jit_compile, learning_rate, accumulation_steps)
+
+    return head
+
+def assemble_model(extractor, head, jit_compile=False):
+    """Joins extractor and head back into a single image -> score model"""
+    input_layer = layers.Input(shape=extractor.input_shape[1:])
+    output_layer = head(extractor(input_layer))
+
+    model = keras.Model(inputs=input_layer, outputs=output_layer)
+    _compile_continuous(model, jit_compile)
+
+    return model
+
+def init_student_continuous(height, width, backbone='mobilenet', alpha=0.5, jit_compile=False, accumulation_steps=1, lr_decay=False):
+    """
+    Single-backbone model trained against [mos, teacher score] targets with DistillationLoss.
+    backbone is 'mobilenet' (the pretrained NIMA MobileNet, fine-tuned) or 'efficientnet' (EfficientNetV2B0).
+    accumulation_steps and lr_decay work as in init_model_continuous.
+    """
+    input_layer = layers.Input(shape=(height, width, 3))
+
+    if backbone == 'mobilenet':
+        x = _nima_route(input_layer, trainable=True)
+    elif backbone == 'efficientnet':
+        effnet = tf.keras.applications.EfficientNetV2B0(
+            include_top=False,
+            weights='imagenet',
+            input_shape=(height, width, 3),
+            include_preprocessing=True,
+            pooling='avg'
+        )
+        x = effnet(input_layer)
+    else:
+        raise ValueError(f"Unknown student backbone: {backbone}")
+
+    x = _dense_blocks(x, [256, 128, 64])
+    output_layer = layers.Dense(units=1, activation='linear', dtype='float32')(x)
+
+    model = keras.Model(inputs=input_layer, outputs=output_layer, name=f'student_{backbone}')
+
+    learning_rate = _decay_schedule(accumulation_steps) if lr_decay else LEARNING_RATE
+    model.compile(
+        jit_compile=jit_compile,
+        optimizer=_adam(learning_rate, accumulation_steps),
+        loss=DistillationLoss(alpha),
+        metrics=[mos_rmse, mos_mae]
+    )
+
     return model
 
-def init_model_categorical(height, width):
+def init_model_categorical(height, width, jit_compile=False):
     input_layer = layers.Input(shape=(height, width, 3))
     hidden_layers = _hidden_layers(input_layer)
-    output_layer = layers.Dense(units=41, activation='softmax')(hidden_layers)
+    output_layer = layers.Dense(units=41, activation='softmax', dtype='float32')(hidden_layers)
 
     model = keras.Model(inputs=input_layer, outputs=output_layer)
 
     model.compile(
+        jit_compile=jit_compile,
         optimizer=keras.optimizers.Adam(),
         loss=keras.losses.CategoricalCrossentropy(),
         metrics=["accuracy"]
@@ -168,11 +297,23 @@ def init_model_categorical(height, width):
 
     return model
 
-def load_model(path):
-    return keras.models.load_model(path)
+def load_model(path, checkpoint_dir=None, jit_compile=None):
+    """Loads a .keras archive; with checkpoint_dir, the latest incremental checkpoint is applied on top.
+    Layer dtype policies are stored in the archive, so the precision is the one the model was built with."""
+    model = keras.models.load_model(path)
+
+    if jit_compile is not None:
+        model.jit_compile = jit_compile
+
+    if checkpoint_dir is not None:
+        checkpoints.restore_latest(model, checkpoint_dir)
+
+    return model
 
 def save_model(model, path):
+    """Also writes a json metadata sidecar, so tools can describe the model without loading it"""
     if model is None:
         raise ValueError("Model has not been created.")
     
     model.save(path)
+    model_info.write(model, path)
@@ -0,0 +1,78 @@
+import tensorflow as tf
+import numpy as np
+
+import images
+from experimental.extractpatches import extract_patches
+
+REDUCERS = ('mean', 'median', 'trimmed')
+TRIM = 0.1
+
+def tile_image(image, crop_height, crop_width):
+    """Cuts a full-resolution [h, w, 3] image into a grid of non-overlapping crops, [n, crop_height, crop_width, 3].
+    The grid is centered; images smaller than one crop are upscaled first."""
+    shape = tf.shape(image)
+    height, width = shape[0], shape[1]
+
+    scale = tf.maximum(1.0, tf.maximum(crop_height / tf.cast(height, tf.float32), crop_width / tf.cast(width, tf.float32)))
+    height = tf.cast(tf.math.ceil(tf.cast(height, tf.float32) * scale), tf.int32)
+    width = tf.cast(tf.math.ceil(tf.cast(width, tf.float32) * scale), tf.int32)
+    image = tf.cond(scale > 1.0, lambda: tf.image.resize(image, [height, width]), lambda: image)
+
+    grid = (height // crop_height, width // crop_width)
+    image = tf.image.resize_with_crop_or_pad(image, grid[0] * crop_height, grid[1] * crop_width)
+
+    # patches come out stacked along channels as (grid_h, grid_w, 3)
+    patches = extract_patches(image[tf.newaxis], grid)
+    patches = tf.reshape(patches, [crop_height, crop_width, grid[0] * grid[1], 3])
+    return tf.transpose(patches, perm=[2, 0, 1, 3])
+
+def crop_dataset(paths, crop_height, crop_width, batch_size):
+    """Crops of all images packed into fixed-size batches of (crops, image index), regardless of image boundaries"""
+    def load(index, path):
+        crops = tile_image(images.load_full_image(path), crop_height, crop_width)
+        ids = tf.fill([tf.shape(crops)[0]], index)
+        return crops, ids
+
+    return (tf.data.Dataset.from_tensor_slices((tf.range(len(paths), dtype=tf.int64), paths))
+        .map(load, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        .unbatch()
+        .batch(batch_size)
+        .prefetch(tf.data.experimental.AUTOTUNE)
+    )
+
+def reduce_scores(scores, ids, count, reducer='mean'):
+    """Aggregates per-crop scores into per-image scores without looping over images"""
+    if reducer not in REDUCERS:
+        raise ValueError(f"Unknown reducer '{reducer}', expected one of {REDUCERS}")
+
+    crops = np.bincount(ids, minlength=count)
+    if reducer == 'mean':
+        return (np.bincount(ids, weights=scores, minlength=count) / np.maximum(crops, 1)).astype(np.float32)
+
+    # crops of one image are contiguous, so they can be scattered into a padded [images, max_crops] table
+    order = np.argsort(ids, kind='stable')
+    ids, scores = ids[order], scores[order]
+    starts = np.concatenate([[0], np.cumsum(crops)[:-1]])
+    table = np.full((count, crops.max()), np.nan, dtype=np.float64)
+    table[ids, np.arange(len(ids)) - starts[ids]] = scores
+
+    if reducer == 'median':
+        return np.nanmedian(table, axis=1).astype(np.float32)
+
+    # trimmed mean: drop TRIM of the crops on each side, nan sorts last
+    table = np.sort(table, axis=1)
+    cut = np.floor(crops * TRIM).astype(np.int64)
+    cols = np.arange(table.shape[1])[np.newaxis, :]
+    keep = (cols >= cut[:, np.newaxis]) & (cols < (crops - cut)[:, np.newaxis])
+    return (np.where(keep, table, 0.0).sum(axis=1) / np.maximum(keep.sum(axis=1), 1)).astype(np.float32)
+
+def predict(model, paths, batch_size=64, reducer='mean'):
+    """Per-image scores of full-resolution images from all of their model-sized crops"""
+    crop_height, crop_width = model.input_shape[1:3]
+
+    scores, ids = [], []
+    for crops, crop_ids in crop_dataset(paths, crop_height, crop_width, batch_size):
+        scores.append(model.predict_on_batch(crops).reshape(-1))
+        ids.append(crop_ids.numpy())
+
+    return reduce_scores(np.concatenate(scores), np.concatenate(ids), len(paths), reducer)
@@ -0,0 +1,178 @@
+import time, itertools
+import tensorflow as tf
+
+import images
+
+class InputWaitCallback(tf.keras.callbacks.Callback):
+    """
+    Splits every epoch into time spent waiting for the input pipeline and time spent in the model step.
+    A high input-wait fraction means the run is input-bound.
+
+    Keras fetches the next batch inside its compiled train function, so batch callbacks alone cannot see
+    the wait. timed() appends a stage to the fit dataset that stamps each batch as it leaves the pipeline;
+    it runs synchronously in the consumer's get-next call, so the stamp marks the end of that batch's wait,
+    which started at on_train_batch_begin. In distributed runs batches are prefetched once more onto the
+    replicas, so the fraction is a lower bound there.
+    """
+    def __init__(self, tracker, log_dir):
+        super().__init__()
+        self.tracker = tracker
+        self.writer = tf.summary.create_file_writer(log_dir)
+        self._ready = None
+
+    def _stamp(self):
+        self._ready = time.perf_counter()
+        return 0
+
+    def timed(self, dataset):
+        """The dataset with the stamping stage as its last transformation"""
+        def stamp(*element):
+            ready = tf.py_function(self._stamp, [], tf.int64)
+            with tf.control_dependencies([ready]):
+                element = tf.nest.map_structure(tf.identity, element)
+            return element if len(element) > 1 else element[0]
+
+        options = tf.data.Options()
+        # a prefetch injected after the stamp would move it off the consumer's get-next call
+        options.experimental_optimization.inject_prefetch = False
+        return dataset.map(stamp).with_options(options)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.wait = 0.0
+        self.step = 0.0
+        self.steps = 0
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._begin = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        now = time.perf_counter()
+        elapsed = now - self._begin
+
+        # a stamp from before the step began means the batch was already waiting in a buffer
+        ready = self._ready if self._ready is not None else self._begin
+        wait = min(max(ready - self._begin, 0.0), elapsed)
+
+        self.wait += wait
+        self.step += elapsed - wait
+        self.steps += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        if self.steps == 0:
+            return
+
+        fraction = self.wait / max(self.wait + self.step, 1e-9)
+        wait_ms = self.wait / self.steps * 1000
+        step_ms = self.step / self.steps * 1000
+
+        self.tracker.log(f"Epoch {epoch + 1}: input wait {fraction:.1%}, {wait_ms:.1f} ms wait + {step_ms:.1f} ms step per batch")
+
+        with self.writer.as_default():
+            tf.summary.scalar('pipeline/input_wait_fraction', fraction, step=epoch)
+            tf.summary.scalar('pipeline/wait_ms_per_batch', wait_ms, step=epoch)
+            tf.summary.scalar('pipeline/step_ms_per_batch', step_ms, step=epoch)
+        self.writer.flush()
+
+def stage_datasets(paths, height, width, crop_height, crop_width, batch_size):
+    """Cumulative prefixes of the training input pipeline, as (stage name, dataset, images per element)"""
+    autotune = tf.data.experimental.AUTOTUNE
+
+    read = tf.data.Dataset.from_tensor_slices(paths).map(tf.io.read_file, num_parallel_calls=autotune)
+    decode = read.map(lambda data: tf.image.decode_jpeg(data, channels=3), num_parallel_calls=autotune)
+    resize = decode.map(lambda image: tf.image.resize(image, [height, width]), num_parallel_calls=autotune)
+    crop = resize.map(lambda image: images.random_crop_image(image, crop_height, crop_width), num_parallel_calls=autotune)
+    batch = crop.batch(batch_size).prefetch(autotune)
+
+    return [
+        ('read', read, 1),
+        ('decode', decode, 1),
+        ('resize', resize, 1),
+        ('crop', crop, 1),
+        ('batch', batch, batch_size),
+    ]
+
+def measure(dataset, images_per_element, max_elements=None, warmup=2):
+    """Images/sec of iterating a dataset with no model attached"""
+    iterator = iter(dataset)
+    for _ in range(warmup):
+        if next(iterator, None) is None:
+            break
+
+    count = 0
+    start = time.perf_counter()
+    for element in iterator:
+        count += images_per_element
+        if max_elements is not None and count >= max_elements * images_per_element:
+            break
+    elapsed = time.perf_counter() - start
+
+    return count / elapsed if elapsed > 0 else 0.0
+
+def _with_labels(images):
+    return images, tf.zeros([tf.shape(images)[0], 1])
+
+def measure_steps(model, dataset, batch_size, max_batches=None, warmup=2, repeat_first=False):
+    """
+    Images/sec of train steps fed from a dataset of image batches. repeat_first=True trains on the
+    first batch over and over, which times the model step alone, without the input pipeline.
+    """
+    iterator = iter(dataset.map(_with_labels))
+    first = next(iterator)
+    batches = itertools.repeat(first, max_batches or 1) if repeat_first else iterator
+
+    for _ in range(warmup):
+        model.train_on_batch(*first)
+
+    count = 0
+    start = time.perf_counter()
+    for images, labels in batches:
+        model.train_on_batch(images, labels)
+        count += batch_size
+        if max_batches is not None and count >= max_batches * batch_size:
+            break
+    elapsed = time.perf_counter() - start
+
+    return count / elapsed if elapsed > 0 else 0.0
+
+def profile_stages(paths, height, width, crop_height, crop_width, batch_size, max_elements=None, model=None):
+    """
+    Throughput of each pipeline prefix and the marginal per-image cost each stage adds.
+    With a model two rows follow: 'step', its train step alone on a repeated batch, and 'fit', the full
+    pipeline feeding that step; 'fit' also reports the share of its time the step does not account for.
+    """
+    results = []
+    previous_cost = 0.0
+    for name, dataset, per_element in stage_datasets(paths, height, width, crop_height, crop_width, batch_size):
+        limit = None if max_elements is None else max(max_elements // per_element, 1)
+        rate = measure(dataset, per_element, limit)
+
+        cost = 1000.0 / rate if rate > 0 else float('inf')
+        results.append({
+            'stage': name,
+            'images_per_sec': rate,
+            'marginal_ms_per_image': cost - previous_cost,
+        })
+        previous_cost = cost
+
+    if model is None:
+        return results
+
+    batches = max((max_elements or len(paths)) // batch_size, 1)
+    step_rate = measure_steps(model, dataset, batch_size, batches, repeat_first=True)
+    fit_rate = measure_steps(model, dataset, batch_size, batches)
+
+    step_cost = 1000.0 / step_rate if step_rate > 0 else float('inf')
+    fit_cost = 1000.0 / fit_rate if fit_rate > 0 else float('inf')
+    results.append({
+        'stage': 'step',
+        'images_per_sec': step_rate,
+        'marginal_ms_per_image': None,
+    })
+    results.append({
+        'stage': 'fit',
+        'images_per_sec': fit_rate,
+        'marginal_ms_per_image': fit_cost - previous_cost,
+        'input_wait_fraction': max(1.0 - step_cost / fit_cost, 0.0),
+    })
+
+    return results
@@ -0,0 +1,83 @@
+import os, csv
+import numpy as np
+
+import metrics
+
+# slices smaller than this are listed without metrics; correlations on a handful of images are noise
+MIN_SLICE_SIZE = 10
+
+def _names(img_paths):
+    return np.array([os.path.basename(str(path)) for path in img_paths])
+
+def by_prefix(img_paths, prefixes):
+    names = _names(img_paths)
+    return {f'prefix={prefix}': np.char.startswith(names, prefix) for prefix in prefixes}
+
+def by_column(img_paths, metadata_path, column):
+    """One slice per distinct value of a metadata csv column; the first column holds image file names"""
+    with open(metadata_path, 'r', newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        index = header.index(column)
+        values = {row[0]: row[index] for row in reader}
+
+    found = np.array([values.get(name, '') for name in _names(img_paths)])
+    return {f'{column}={value}': found == value for value in sorted(set(found) - {''})}
+
+def by_range(mos, edges):
+    """Slices of MOS in [edges[i], edges[i+1]); the last one includes its upper edge"""
+    mos = np.asarray(mos)
+    slices = {}
+    for i, (low, high) in enumerate(zip(edges[:-1], edges[1:])):
+        last = i == len(edges) - 2
+        mask = (mos >= low) & ((mos <= high) if last else (mos < high))
+        slices[f'mos=[{low}, {high}{"]" if last else ")"}'] = mask
+    return slices
+
+def build(specs, img_paths, mos):
+    """
+    Masks over the evaluated images from specs such as:
+        ('prefix', ['movie', 'game'])
+        ('column', ('data/metadata.csv', 'genre'))
+        ('range', [1, 2, 3, 4, 5])
+    """
+    slices = {'all': np.ones(len(mos), dtype=bool)}
+    for kind, arg in specs:
+        if kind == 'prefix':
+            slices.update(by_prefix(img_paths, arg))
+        elif kind == 'column':
+            slices.update(by_column(img_paths, *arg))
+        elif kind == 'range':
+            slices.update(by_range(mos, arg))
+        else:
+            raise ValueError(f"Unknown slice kind: {kind}")
+    return slices
+
+def evaluate(mos, predictions, slices):
+    """One row per slice, all from the same predictions"""
+    mos = np.asarray(mos)
+    predictions = np.asarray(predictions)
+
+    rows = []
+    for name, mask in slices.items():
+        row = {'slice': name, 'count': int(mask.sum())}
+        if row['count'] >= MIN_SLICE_SIZE:
+            row.update(metrics.compute_metrics(mos[mask], predictions[mask]))
+        rows.append(row)
+    return rows
+
+def print_table(rows):
+    columns = [name for name in dict.fromkeys(name for row in rows for name in row) if name not in ('slice', 'count')]
+    width = max(len(row['slice']) for row in rows) + 2
+
+    print(f"{'slice':<{width}}{'count':>7}" + ''.join(f'{name:>9}' for name in columns))
+    for row in rows:
+        values = ''.join(f'{row[name]:>9.4f}' if name in row else f'{"-":>9}' for name in columns)
+        print(f"{row['slice']:<{width}}{row['count']:>7}" + values)
+
+def save_table(rows, path):
+    columns = list(dict.fromkeys(name for row in rows for name in row))
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
@@ -1,44 +1,117 @@
-import os, datetime, configparser
+import os, datetime, configparser, threading, time, atexit
 
 class Tracker:
+    """
+    Keeps training progress in a status file and writes the run log.
 
-    def __init__(self, log_path, status_path):
+    Log lines and status updates are buffered and written by a background thread
+    every `flush_interval` seconds, so callbacks never block on file I/O.
+    Call flush() or close() before exiting to persist everything that is pending.
+    """
+
+    def __init__(self, log_path, status_path, flush_interval=5.0, progress_interval=10.0):
         self.log_path = log_path
         self.status_path = status_path
+        self.flush_interval = flush_interval
+        self.progress_interval = progress_interval
 
         self.batch = 0
         self.epoch = 0
 
+        # position the latest saved weights correspond to, which is what the status file records;
+        # it trails `epoch` while a checkpoint is still being written. batch 0 means epoch start
+        self.saved_epoch = 0
+        self.saved_batch = 0
+
+        # reentrant, since the SIGTERM handler may log while the main thread holds it
+        self._lock = threading.RLock()
+        self._buffer = []
+        self._written_status = None
+        self._last_progress = 0.0
+        self._stop = threading.Event()
+
         os.makedirs(os.path.dirname(log_path), exist_ok=True)
         os.makedirs(os.path.dirname(status_path), exist_ok=True)
         
         if not os.path.isfile(self.status_path):
-            self.save_status()
+            self._write_status(self._status())
             self.logprint("Created status file")
         else:
             self.load_status()
-            obj = {'epoch': self.epoch}
-            self.logprint(f"Loaded status file: {obj}")
+            self._written_status = self._status()
+            self.logprint(f"Loaded status file: {self._written_status}")
+
+        self._thread = threading.Thread(target=self._run, name='tracker-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _status(self):
+        return {'epoch': self.saved_epoch, 'batch': self.saved_batch}
 
     def load_status(self):
         config = configparser.ConfigParser()
         config.read(self.status_path)
         
         self.epoch = config.getint('progress', 'epoch', fallback=0)
+        self.saved_epoch = self.epoch
+        self.saved_batch = config.getint('progress', 'batch', fallback=0)
+        self.batch = self.saved_batch
 
-    def save_status(self):
+    def _write_status(self, status):
         config = configparser.ConfigParser()
-        config['progress'] = {
-            'epoch': self.epoch,
-        }
-        
-        with open(self.status_path, 'w') as configfile:
+        config['progress'] = status
+
+        # write-and-rename, so a crash never leaves a truncated status file
+        tmp_path = f'{self.status_path}.tmp'
+        with open(tmp_path, 'w') as configfile:
             config.write(configfile)
+        os.replace(tmp_path, self.status_path)
+
+        self._written_status = status
+
+    def save_status(self):
+        """Writes the status file now, skipping the write when nothing changed"""
+        with self._lock:
+            status = self._status()
+            if status != self._written_status:
+                self._write_status(status)
+
+    def mark_saved(self, epoch, batch=0):
+        """Records weights saved at `batch` of `epoch` and writes the status file; safe to call from any thread"""
+        with self._lock:
+            self.saved_epoch = epoch
+            self.saved_batch = batch
+            self.save_status()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+
+            if lines:
+                with open(self.log_path, 'a') as file:
+                    file.writelines(lines)
+
+        self.save_status()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
 
     def log(self, message):
-        with open(self.log_path, 'a') as file:
-            timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            file.write(f"[{timestamp}] {message}\n")
+        timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            self._buffer.append(f"[{timestamp}] {message}\n")
+
+    def progress(self, message):
+        """Rate-limited log, for messages emitted every batch"""
+        now = time.monotonic()
+        if now - self._last_progress >= self.progress_interval:
+            self._last_progress = now
+            self.log(message)
 
     def logprint(self, message):
         print(message)
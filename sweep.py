@@ -0,0 +1,240 @@
+import os, sys, json, math, argparse, itertools, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(f'{PROJECT_DIR}/src')
+
+import tensorflow as tf
+from tensorboard.plugins.hparams import api as hp
+
+import images, labels, models
+from feature_cache import FeatureCache, crop_key
+
+# input
+DATA_DIR = f'{PROJECT_DIR}/data'
+MOS_FILE = f'{DATA_DIR}/mos.csv'
+FIT_IMG_DIR = f'{DATA_DIR}/images/train'
+VAL_IMG_DIR = f'{DATA_DIR}/images/test'
+FEATURE_CACHE_DIR = f'{DATA_DIR}/cache/features'
+
+# output
+SWEEP_NAME = 'sweep'
+OUTPUT_DIR = f'{PROJECT_DIR}/output/sweeps/{SWEEP_NAME}'
+
+HEIGHT = 256
+WIDTH = 256
+MODEL_HEIGHT = 224
+MODEL_WIDTH = 224
+PRECISION = 'float32'
+
+SEED = 23478
+
+# values used for hyperparameters the spec does not mention, matching train.py
+DEFAULTS = {
+    'learning_rate': models.LEARNING_RATE,
+    'dropout': models.DROPOUT_DENSE,
+    'batch_size': 32,
+    'label_noise': 0.1,
+}
+
+tf.keras.config.enable_unsafe_deserialization()
+
+def sample_trials(spec):
+    """
+    Expands a search spec into trial hyperparameters. Example spec:
+        {"method": "random", "trials": 16, "params": {
+            "learning_rate": {"min": 1e-5, "max": 1e-3, "log": true},
+            "dropout": [0.3, 0.5]}}
+    With "method": "grid", every param must be a list of values.
+    """
+    params = spec['params']
+    unknown = set(params) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown hyperparameters in spec: {sorted(unknown)}")
+
+    if spec.get('method', 'grid') == 'grid':
+        names = list(params)
+        combos = itertools.product(*[params[name] for name in names])
+        return [dict(DEFAULTS, **dict(zip(names, combo))) for combo in combos]
+
+    rng = np.random.default_rng(spec.get('seed', SEED))
+    trials = []
+    for _ in range(spec['trials']):
+        trial = dict(DEFAULTS)
+        for name, space in params.items():
+            if isinstance(space, list):
+                trial[name] = space[rng.integers(len(space))]
+            elif space.get('log'):
+                trial[name] = float(np.exp(rng.uniform(np.log(space['min']), np.log(space['max']))))
+            else:
+                trial[name] = float(rng.uniform(space['min'], space['max']))
+        trial['batch_size'] = int(trial['batch_size'])
+        trials.append(trial)
+    return trials
+
+def fill_cache(fit_imgs, val_imgs):
+    """Runs the frozen backbones once over all images; trials only ever read the cache"""
+    models.set_precision(PRECISION)
+    extractor = models.init_feature_extractor(MODEL_HEIGHT, MODEL_WIDTH)
+    key = crop_key(HEIGHT, WIDTH, MODEL_HEIGHT, MODEL_WIDTH, PRECISION)
+    cache = FeatureCache.for_extractor(FEATURE_CACHE_DIR, extractor, key)
+
+    load = lambda path: images.load_center_cropped(path, HEIGHT, WIDTH, MODEL_HEIGHT, MODEL_WIDTH)
+    for paths in [fit_imgs, val_imgs]:
+        computed = cache.fill(paths, load)
+        print(f"Feature cache: computed {computed}, reused {len(paths) - computed} embeddings")
+
+    return cache.dir, cache.shapes, key
+
+_worker = {}
+
+def _init_worker(cores, threads, store, data):
+    """Pins the worker to its share of cores and opens the shared feature cache read-only"""
+    share = cores.get()
+    if share and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, share)
+
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(2)
+    models.set_precision(PRECISION)
+
+    cache = FeatureCache(*store, readonly=True)
+    fit_imgs, fit_mos, val_imgs, val_mos = data
+    _worker.update(
+        cache=cache,
+        fit_rows=cache.lookup(fit_imgs),
+        fit_mos=fit_mos,
+        val_rows=cache.lookup(val_imgs),
+        val_mos=val_mos,
+    )
+
+def run_trial(trial_id, params, epochs, trial_dir):
+    """Trains a trial up to `epochs` epochs in total, continuing from its previous rung. Returns its best val_loss"""
+    cache = _worker['cache']
+    fit_rows, fit_mos = _worker['fit_rows'], _worker['fit_mos']
+
+    head_file = f'{trial_dir}/head.keras'
+    state_file = f'{trial_dir}/trial.json'
+
+    if os.path.isfile(state_file):
+        with open(state_file, 'r') as file:
+            state = json.load(file)
+        head = models.load_model(head_file)
+    else:
+        os.makedirs(trial_dir, exist_ok=True)
+        tf.keras.utils.set_random_seed(SEED)
+        head = models.init_head_continuous(cache.shapes, learning_rate=params['learning_rate'], dropout=params['dropout'])
+        state = {'params': params, 'epochs': 0, 'val_loss': []}
+
+        with tf.summary.create_file_writer(trial_dir).as_default():
+            hp.hparams(params, trial_id=trial_id)
+
+    if state['epochs'] >= epochs:
+        return min(state['val_loss'])
+
+    batch_size = params['batch_size']
+    noise = params['label_noise']
+
+    def make_epoch(epoch):
+        seed = tf.stack([tf.constant(SEED, tf.int64), epoch])
+        order = tf.random.experimental.stateless_shuffle(tf.range(len(fit_rows), dtype=tf.int64), seed=seed)
+        return (cache.dataset(tf.gather(fit_rows, order), tf.gather(fit_mos, order), batch_size)
+            .map(lambda features, label: (features, label + tf.random.normal(tf.shape(label), stddev=noise)))
+        )
+
+    dataset = (tf.data.Dataset.range(state['epochs'], epochs)
+        .flat_map(make_epoch)
+        .prefetch(tf.data.experimental.AUTOTUNE)
+    )
+    val_dataset = cache.dataset(_worker['val_rows'], _worker['val_mos'], 64).prefetch(tf.data.experimental.AUTOTUNE)
+
+    history = head.fit(
+        dataset,
+        validation_data=val_dataset,
+        initial_epoch=state['epochs'],
+        epochs=epochs,
+        steps_per_epoch=math.ceil(len(fit_rows) / batch_size),
+        verbose=0,
+    )
+
+    with tf.summary.create_file_writer(trial_dir).as_default():
+        for i, loss in enumerate(history.history['val_loss']):
+            tf.summary.scalar('val_loss', loss, step=state['epochs'] + i + 1)
+
+    state['val_loss'] += [float(loss) for loss in history.history['val_loss']]
+    state['epochs'] = epochs
+
+    models.save_model(head, head_file)
+    with open(state_file, 'w') as file:
+        json.dump(state, file)
+
+    return min(state['val_loss'])
+
+def core_shares(parallel, threads):
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+    if len(cores) < parallel * threads:
+        return [None] * parallel
+    return [cores[i * threads:(i + 1) * threads] for i in range(parallel)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Parallel hyperparameter sweep over the trainable head, with successive halving')
+    parser.add_argument('spec', help='json search spec, see sample_trials')
+    parser.add_argument('-o', '--output', default=OUTPUT_DIR)
+    parser.add_argument('-p', '--parallel', type=int, default=2, help='trials running at once')
+    parser.add_argument('-t', '--threads', type=int, default=max((os.cpu_count() or 2) // 2, 1), help='cpu threads per trial')
+    parser.add_argument('--min-epochs', type=int, default=2, help='epochs of the first rung')
+    parser.add_argument('--max-epochs', type=int, default=40)
+    parser.add_argument('--eta', type=int, default=3, help='keep 1/eta trials per rung, and grow the budget eta times')
+    args = parser.parse_args()
+
+    with open(args.spec, 'r') as file:
+        trials = sample_trials(json.load(file))
+    print(f"Sweeping {len(trials)} trials")
+
+    fit_imgs, fit_mos = labels.load_labeled_images(MOS_FILE, FIT_IMG_DIR)
+    val_imgs, val_mos = labels.load_labeled_images(MOS_FILE, VAL_IMG_DIR)
+    store = fill_cache(fit_imgs, val_imgs)
+
+    os.makedirs(args.output, exist_ok=True)
+    with tf.summary.create_file_writer(args.output).as_default():
+        hp.hparams_config(
+            hparams=[hp.HParam(name) for name in DEFAULTS],
+            metrics=[hp.Metric('val_loss', display_name='val_loss')],
+        )
+
+    context = multiprocessing.get_context('spawn')
+    cores = context.Queue()
+    for share in core_shares(args.parallel, args.threads):
+        cores.put(share)
+
+    survivors = list(range(len(trials)))
+    losses = {}
+    budget = args.min_epochs
+
+    with ProcessPoolExecutor(args.parallel, mp_context=context, initializer=_init_worker,
+                             initargs=(cores, args.threads, store, (fit_imgs, fit_mos, val_imgs, val_mos))) as pool:
+        while True:
+            budget = min(budget, args.max_epochs)
+            futures = {i: pool.submit(run_trial, f'trial_{i:03}', trials[i], budget, f'{args.output}/trial_{i:03}') for i in survivors}
+            for i, future in futures.items():
+                losses[i] = future.result()
+
+            survivors.sort(key=lambda i: losses[i])
+            print(f"Rung of {budget} epochs: best trial_{survivors[0]:03} val_loss {losses[survivors[0]]:.4f}")
+
+            if budget >= args.max_epochs or len(survivors) == 1:
+                break
+
+            survivors = survivors[:max(len(survivors) // args.eta, 1)]
+            budget *= args.eta
+
+    results = sorted(({'trial': f'trial_{i:03}', 'val_loss': losses[i], **trials[i]} for i in losses), key=lambda r: r['val_loss'])
+    with open(f'{args.output}/results.json', 'w') as file:
+        json.dump(results, file, indent=4)
+
+    print(f"Best trial: {results[0]}")
+    print(f"Results in {args.output}, compare them in the tensorboard HParams tab")
+
+if __name__ == '__main__':
+    main()
@@ -1,83 +1,138 @@
-import os, sys, traceback
-import tensorflow as tf
+import os, sys, traceback, argparse, json
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
-from scipy.stats import pearsonr, spearmanr, kendalltau, wasserstein_distance
 
 PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(f'{PROJECT_DIR}/src')
 
-import images, labels, models
+import labels, model_info, config
+from cli import lazy_import
 
+# imported on first use: --help and --check start instantly, and cached predictions are evaluated without tensorflow
+tf = lazy_import('tensorflow')
+images = lazy_import('images')
+models = lazy_import('models')
+image_cache = lazy_import('image_cache')
+multicrop = lazy_import('multicrop')
+metrics = lazy_import('metrics')
+evaluation = lazy_import('evaluation')
+slices = lazy_import('slices')
+
+OUTPUT_ROOT = f'{PROJECT_DIR}/output'
 MODEL_NAME = ''
-OUTPUT_DIR = f'{PROJECT_DIR}/output/{MODEL_NAME}'
-MODEL_PATH = f'{OUTPUT_DIR}/model.keras'
 
-# can be set to 'movie' or 'game' to enforce testing on only one type of image
-IMAGE_TYPE = ''
+DATA_PATH = f'{PROJECT_DIR}/data'
 
-floor = '_' if IMAGE_TYPE != '' else ''
-RESULTS_FILE = f'{OUTPUT_DIR}/predictions{floor}{IMAGE_TYPE}.npy'
-HISTOGRAM_FILE = f'{OUTPUT_DIR}/histogram{floor}{IMAGE_TYPE}.png'
+# computed from the settings by set_paths() after config overrides, not overridable themselves
+DERIVED = ('PROJECT_DIR', 'DERIVED', 'SLICE_KINDS', 'OUTPUT_DIR', 'MODEL_PATH', 'RESULTS_FILE',
+           'HISTOGRAM_FILE', 'SLICES_FILE', 'MOS_PATH', 'IMG_DIRPATH', 'IMAGE_CACHE_DIR', 'METADATA_PATH',
+           'CPU_TUNING_FILE', 'HEIGHT', 'WIDTH', 'IS_CATEGORICAL')
 
-DATA_PATH = f'{PROJECT_DIR}/data'
-MOS_PATH = f'{DATA_PATH}/mos.csv'
-IMG_DIRPATH = f'{DATA_PATH}/images/test'
+def set_paths():
+    global OUTPUT_DIR, MODEL_PATH, RESULTS_FILE, HISTOGRAM_FILE, SLICES_FILE
+    global MOS_PATH, IMG_DIRPATH, IMAGE_CACHE_DIR, METADATA_PATH, CPU_TUNING_FILE
+
+    OUTPUT_DIR = f'{OUTPUT_ROOT}/{MODEL_NAME}'
+    MODEL_PATH = f'{OUTPUT_DIR}/model.keras'
+
+    RESULTS_FILE = f'{OUTPUT_DIR}/predictions.npy'
+    HISTOGRAM_FILE = f'{OUTPUT_DIR}/histogram.png'
+    SLICES_FILE = f'{OUTPUT_DIR}/slices.csv'
+
+    MOS_PATH = f'{DATA_PATH}/mos.csv'
+    IMG_DIRPATH = f'{DATA_PATH}/images/test'
+    IMAGE_CACHE_DIR = f'{DATA_PATH}/cache/images'
+    METADATA_PATH = f'{DATA_PATH}/metadata.csv'
+
+    # written by tools/tune_threads.py; its test settings apply below any --config or --set overrides,
+    # when tuned on as many available cores; its thread counts are skipped when CPU_CORES pins the run
+    CPU_TUNING_FILE = f'{OUTPUT_ROOT}/cpu_tuning.json'
+
+set_paths()
 
 HEIGHT = None
 WIDTH = None
 IS_CATEGORICAL = None
 
 BATCH_SIZE = 32
+JIT_COMPILE = False
+
+# if set, full-resolution images are tiled into model-sized crops and crop scores are
+# aggregated per image with CROP_REDUCER: 'mean', 'median' or 'trimmed'
+MULTI_CROP = False
+CROP_REDUCER = 'mean'
 LIMIT = None
 PRINT_LIMIT = 10
 
-tf.keras.config.enable_unsafe_deserialization()
+# metrics are additionally reported per slice of the test set, from the same single prediction pass:
+# ('prefix', [...]) by file name prefix, ('column', (METADATA_PATH, name)) by a metadata csv column
+# whose first column holds file names, ('range', [edges]) by MOS range
+SLICES = [
+    ('prefix', ['movie', 'game']),
+]
+
+# percentile bootstrap confidence intervals of all metrics; 0 disables.
+# Resamples are spread over BOOTSTRAP_WORKERS processes (None: one per cpu)
+BOOTSTRAP_RESAMPLES = 2000
+BOOTSTRAP_WORKERS = None
+CONFIDENCE = 0.95
 
-def logistic_function(y, beta1, beta2, beta3, beta4, beta5):
-    out = beta1 * (0.5 - 1 / (1 + np.exp(beta2 * (y - beta3)))) + beta4 * y + beta5
-    return out.astype(np.float32)
+# cpu placement, for packing several evaluations onto one node, see train.py
+CPU_CORES = None
+INTRA_OP_THREADS = None
+INTER_OP_THREADS = None
+DATA_THREADS = None
+
+SLICE_KINDS = ('prefix', 'column', 'range')
 
 def load_image(path, label):
     image = images.load_image(path, HEIGHT, WIDTH)
     return image, label
 
-def filter_data(img_paths, mos):
-    img_names = [os.path.basename(path) for path in img_paths]
+def validate_config():
+    errors = []
 
-    f_paths = []
-    f_mos = []
-    for i in range(len(img_names)):
-        if IMAGE_TYPE in img_names[i]:
-            f_paths.append(img_paths[i])
-            f_mos.append(mos[i])
+    if not os.path.isfile(MODEL_PATH):
+        errors.append(f"Model not found at {MODEL_PATH}")
+    if not os.path.isfile(MOS_PATH):
+        errors.append(f"MOS file not found at {MOS_PATH}")
+    if not os.path.isdir(IMG_DIRPATH):
+        errors.append(f"Image directory not found at {IMG_DIRPATH}")
 
-    return (f_paths, f_mos)
+    for kind, arg in SLICES:
+        if kind not in SLICE_KINDS:
+            errors.append(f"Unknown slice kind {kind!r}, expected one of {SLICE_KINDS}")
+        elif kind == 'column' and not os.path.isfile(arg[0]):
+            errors.append(f"Slice metadata file not found at {arg[0]}")
 
-def main():
-    global HEIGHT, WIDTH, IS_CATEGORICAL
+    return errors
 
-    img_paths = images.get_image_list(IMG_DIRPATH)
-    mos = labels.load_continuous(MOS_PATH, IMG_DIRPATH)
-    print(f"Detected {len(mos)} labels and {len(img_paths)} images")
+def check():
+    """Validates the settings and scans the test set, without tensorflow"""
+    errors = validate_config()
+    for error in errors:
+        print(f"Config error: {error}")
+    if errors:
+        return False
 
-    if LIMIT != None and LIMIT < len(mos):
-        print(f"Limited images to {LIMIT}")
-        mos = mos[:LIMIT]
-        img_paths = img_paths[:LIMIT]
+    img_paths, mos = labels.load_labeled_images(MOS_PATH, IMG_DIRPATH)
+    print(f"Labeled test images: {min(len(mos), LIMIT or len(mos))}")
 
-    if IMAGE_TYPE != '':
-        img_paths, mos = filter_data(img_paths, mos)
-        print(f"Limiting image type to '{IMAGE_TYPE}': detected {len(mos)} images")
+    info = model_info.read(MODEL_PATH)
+    if info is not None:
+        print(f"Model input shape: {info['input_shape']}, precision policy: {info['dtype_policy']}")
+    return True
 
-    if not os.path.isfile(MODEL_PATH):
-        print("Fatal error: model could not be found")
-        sys.exit(-1)
+def predict(img_paths, mos):
+    global HEIGHT, WIDTH
+
+    cores = config.parse_cores(CPU_CORES) if CPU_CORES is not None else None
+    config.set_tf_threads(INTRA_OP_THREADS or (len(cores) if cores else None), INTER_OP_THREADS)
+
+    tf.keras.config.enable_unsafe_deserialization()
 
     try:
-        model = models.load_model(MODEL_PATH)
-        print(f"Loaded model")
+        model = models.load_model(MODEL_PATH, jit_compile=JIT_COMPILE)
+        print(f"Loaded model, precision policy: {model.dtype_policy.name}, XLA: {JIT_COMPILE}")
     except Exception as e:
         print(f"Fatal error while initializing model")
         traceback.print_exc()
@@ -90,36 +145,79 @@ def main():
         print(f"Testing for classification models not included, sorry!")
         exit()
 
-    dataset = (tf.data.Dataset.from_tensor_slices((img_paths, mos))
-        .map(load_image)
-        .batch(BATCH_SIZE)
-        .prefetch(tf.data.experimental.AUTOTUNE)
-    )
+    if MULTI_CROP:
+        print(f"Scoring full-resolution crops, reducer: {CROP_REDUCER}")
+        predictions = multicrop.predict(model, img_paths, BATCH_SIZE, CROP_REDUCER)
+    else:
+        cache_dir = image_cache.cache_path(IMAGE_CACHE_DIR, IMG_DIRPATH, HEIGHT, WIDTH)
+        cache = image_cache.ImageCache(cache_dir) if image_cache.exists(cache_dir) else None
+
+        # a cache built before images were added, or at another size, would fail or score the wrong pixels
+        if cache is not None and not cache.covers(img_paths, HEIGHT, WIDTH):
+            print(f"Preprocessed cache at {cache_dir} does not match the test set, decoding images instead")
+            cache = None
+
+        if cache is not None:
+            print(f"Reading images from preprocessed cache at {cache_dir}")
+            dataset = cache.dataset(cache.lookup(img_paths), mos)
+        else:
+            dataset = tf.data.Dataset.from_tensor_slices((img_paths, mos)).map(load_image)
+
+        dataset = (dataset
+            .batch(BATCH_SIZE)
+            .prefetch(tf.data.experimental.AUTOTUNE)
+        )
+        dataset = config.with_data_threads(dataset, DATA_THREADS)
+        predictions = model.predict(dataset).flatten()
+
+    return predictions
+
+def main():
+    # before tensorflow is imported, which sizes its pools once at startup; numpy's are already sized, only affinity applies to them
+    config.pin_cpus(CPU_CORES, INTRA_OP_THREADS)
+
+    errors = validate_config()
+    if errors:
+        for error in errors:
+            print(f"Fatal error: {error}")
+        sys.exit(-1)
 
-    predictions = model.predict(dataset).flatten()
-    np.save(RESULTS_FILE, predictions)
+    img_paths, mos = labels.load_labeled_images(MOS_PATH, IMG_DIRPATH)
+    print(f"Detected {len(mos)} labeled images")
 
-    params, covariance = curve_fit(logistic_function, predictions, mos, p0=[1, 1, 1, 1, 1])
+    if LIMIT != None and LIMIT < len(mos):
+        print(f"Limited images to {LIMIT}")
+        mos = mos[:LIMIT]
+        img_paths = img_paths[:LIMIT]
+
+    key = evaluation.prediction_key(MODEL_PATH, img_paths, multi_crop=MULTI_CROP, reducer=CROP_REDUCER if MULTI_CROP else None)
+    predictions = evaluation.load_predictions(RESULTS_FILE, key)
+
+    if predictions is not None:
+        print(f"Reusing predictions from {RESULTS_FILE}: model and image list are unchanged")
+    else:
+        predictions = predict(img_paths, mos)
+        evaluation.save_predictions(RESULTS_FILE, predictions, key, img_paths)
+
+    params, predictions = metrics.fit_logistic(predictions, mos)
     beta1, beta2, beta3, beta4, beta5 = params
 
     print("Fitted Parameters:")
     print(f"β1 = {beta1}, β2 = {beta2}, β3 = {beta3}, β4 = {beta4}, β5 = {beta5}")
 
-    predictions = logistic_function(predictions, *params)
+    metrics.print_metrics(metrics.compute_metrics(mos, predictions))
 
-    tf_metrics = [
-        ['MAE', tf.keras.metrics.MeanAbsoluteError()],
-        ['MSE', tf.keras.metrics.MeanSquaredError()],
-        ['RMSE', tf.keras.metrics.RootMeanSquaredError()]
-    ]
-    for metric in tf_metrics:
-        metric[1].update_state(mos, predictions)
-        print(f'{metric[0]}: {metric[1].result():.4f}')
+    if BOOTSTRAP_RESAMPLES:
+        print(f"Bootstrap confidence intervals over {BOOTSTRAP_RESAMPLES} resamples:")
+        ci = evaluation.bootstrap_ci(mos, predictions, BOOTSTRAP_RESAMPLES, CONFIDENCE, BOOTSTRAP_WORKERS)
+        evaluation.print_ci(ci, CONFIDENCE)
 
-    print(f"EMD: {wasserstein_distance(mos, predictions):.4f}")
-    print(f'PLCC: {pearsonr(mos, predictions)[0]:.4f}')
-    print(f'SRCC: {spearmanr(mos, predictions)[0]:.4f}')
-    print(f'KRCC: {kendalltau(mos, predictions)[0]:.4f}')
+    if SLICES:
+        # the logistic mapping is fitted on the whole set, so slice metrics are comparable with each other
+        rows = slices.evaluate(mos, predictions, slices.build(SLICES, img_paths, mos))
+        print("Metrics per slice:")
+        slices.print_table(rows)
+        slices.save_table(rows, SLICES_FILE)
 
     mae = np.abs(predictions - mos)
     print(f"highest error: {np.max(mae)}")
@@ -133,6 +231,7 @@ def main():
         print(f"{i+1}. {float(merged[i,0]):.3f} for {float(merged[i,1]):.3f} (error {float(merged[i,2]):.4f}): {merged[i,3]}")
 
     # histogram
+    import matplotlib.pyplot as plt
     plt.hist(mos, bins=100)
     plt.hist(predictions, bins=100)
     plt.xlabel('Value')
@@ -141,4 +240,27 @@ def main():
     plt.savefig(HISTOGRAM_FILE)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluates the model configured by the constants at the top of test.py on the test set')
+    parser.add_argument('--check', action='store_true', help='validate the settings and scan the test set without starting tensorflow, then exit')
+    config.add_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        values = config.overrides(args)
+        config.apply(globals(), values, DERIVED)
+        set_paths()
+
+        tuning = config.tuned(CPU_TUNING_FILE, 'test', pinned=CPU_CORES is not None)
+        config.apply(globals(), {name: value for name, value in tuning.items() if name not in values}, DERIVED)
+    except (config.ConfigError, OSError, json.JSONDecodeError) as e:
+        print(f"Config error: {e}")
+        sys.exit(1)
+
+    if args.print_config:
+        print(json.dumps(config.settings(globals(), DERIVED), indent=4))
+        sys.exit(0)
+
+    if args.check:
+        sys.exit(0 if check() else 1)
+
     main()
@@ -0,0 +1,46 @@
+import os, sys, argparse
+import numpy as np
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(PROJECT_DIR)
+sys.path.append(f'{PROJECT_DIR}/src')
+
+import labels, metrics, evaluation
+
+MOS_PATH = f'{PROJECT_DIR}/data/mos.csv'
+IMG_DIRPATH = f'{PROJECT_DIR}/data/images/test'
+
+def main():
+    parser = argparse.ArgumentParser(description='Paired bootstrap test between the saved predictions of two models on the same test images')
+    parser.add_argument('predictions_a', help='predictions*.npy written by test.py')
+    parser.add_argument('predictions_b')
+    parser.add_argument('--mos', default=MOS_PATH)
+    parser.add_argument('--images', default=IMG_DIRPATH)
+    parser.add_argument('--resamples', type=int, default=evaluation.RESAMPLES)
+    parser.add_argument('--confidence', type=float, default=evaluation.CONFIDENCE)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    names = evaluation.load_prediction_images(args.predictions_a)
+    if names != evaluation.load_prediction_images(args.predictions_b):
+        print("Fatal error: the prediction files were made on different image lists")
+        sys.exit(-1)
+
+    img_paths, mos = labels.load_labeled_images(args.mos, args.images)
+    by_name = dict(zip((os.path.basename(path) for path in img_paths), mos))
+    missing = [name for name in names if name not in by_name]
+    if missing:
+        print(f"Fatal error: {len(missing)} predicted images have no label in {args.mos}, e.g. {missing[0]}")
+        sys.exit(-1)
+    mos = np.array([by_name[name] for name in names], dtype=np.float32)
+
+    # each model gets its own logistic mapping, as in test.py
+    _, a = metrics.fit_logistic(np.load(args.predictions_a), mos)
+    _, b = metrics.fit_logistic(np.load(args.predictions_b), mos)
+
+    print(f"Paired bootstrap over {len(mos)} images and {args.resamples} resamples, a: {args.predictions_a}, b: {args.predictions_b}")
+    results = evaluation.paired_bootstrap(mos, a, b, args.resamples, args.confidence, args.workers)
+    evaluation.print_paired(results, args.confidence)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import os, sys, time, argparse
+import numpy as np
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(PROJECT_DIR)
+sys.path.append(f'{PROJECT_DIR}/src')
+
+import tensorflow as tf
+
+import images, labels, models, metrics
+
+MODEL_NAME = ''
+OUTPUT_DIR = f'{PROJECT_DIR}/output/{MODEL_NAME}'
+MODEL_PATH = f'{OUTPUT_DIR}/model.keras'
+
+DATA_DIR = f'{PROJECT_DIR}/data'
+MOS_PATH = f'{DATA_DIR}/mos.csv'
+TRAIN_DIR = f'{DATA_DIR}/images/train'
+TEST_DIR = f'{DATA_DIR}/images/test'
+
+REPRESENTATIVE_SAMPLES = 200
+BENCHMARK_RUNS = 50
+
+tf.keras.config.enable_unsafe_deserialization()
+
+def representative_dataset(height, width, samples):
+    paths = images.get_image_list(TRAIN_DIR)
+    paths = np.random.default_rng(0).permutation(paths)[:samples]
+
+    def generator():
+        for path in paths:
+            yield [images.load_image(path, height, width)[tf.newaxis]]
+
+    return generator
+
+def convert(model, variant, height, width, samples):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+
+    # float32 keeps the converter defaults: Optimize.DEFAULT alone would quantize weights to int8
+    if variant == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == 'int8':
+        # full-integer: weights and activations in int8, raw uint8 pixels in, float score out
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset(height, width, samples)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8
+
+    return converter.convert()
+
+def _prepare(image, detail):
+    if detail['dtype'] == np.float32:
+        return image.astype(np.float32)
+
+    scale, zero_point = detail['quantization']
+    info = np.iinfo(detail['dtype'])
+    quantized = np.round(image / scale + zero_point)
+    return np.clip(quantized, info.min, info.max).astype(detail['dtype'])
+
+def _output(interpreter, detail):
+    out = interpreter.get_tensor(detail['index'])
+    if detail['dtype'] != np.float32:
+        scale, zero_point = detail['quantization']
+        out = (out.astype(np.float32) - zero_point) * scale
+    return out
+
+def evaluate(model_bytes, img_paths, mos, threads):
+    interpreter = tf.lite.Interpreter(model_content=model_bytes, num_threads=threads)
+    interpreter.allocate_tensors()
+
+    input_detail = interpreter.get_input_details()[0]
+    output_detail = interpreter.get_output_details()[0]
+    height, width = input_detail['shape'][1:3]
+
+    decoded = [images.load_image(path, height, width).numpy()[np.newaxis] for path in img_paths]
+
+    predictions = []
+    for image in decoded:
+        interpreter.set_tensor(input_detail['index'], _prepare(image, input_detail))
+        interpreter.invoke()
+        predictions.append(_output(interpreter, output_detail).reshape(-1)[0])
+    predictions = np.array(predictions, dtype=np.float32)
+
+    latencies = []
+    for i in range(min(BENCHMARK_RUNS, len(decoded))):
+        interpreter.set_tensor(input_detail['index'], _prepare(decoded[i], input_detail))
+        start = time.perf_counter()
+        interpreter.invoke()
+        latencies.append(time.perf_counter() - start)
+
+    _, fitted = metrics.fit_logistic(predictions, mos)
+    results = metrics.compute_metrics(mos, fitted)
+    results['latency_p50_ms'] = float(np.percentile(latencies, 50) * 1000)
+    results['latency_p95_ms'] = float(np.percentile(latencies, 95) * 1000)
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a trained model to TFLite and compare quantized variants')
+    parser.add_argument('-m', '--model', default=MODEL_PATH)
+    parser.add_argument('-o', '--out-dir', default=OUTPUT_DIR)
+    parser.add_argument('--variants', nargs='+', choices=['float32', 'float16', 'int8'], default=['float32', 'float16', 'int8'])
+    parser.add_argument('--samples', type=int, default=REPRESENTATIVE_SAMPLES, help='representative images for int8 calibration')
+    parser.add_argument('--limit', type=int, default=None, help='evaluate on n first test images only')
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+
+    model = models.load_model(args.model)
+    height, width = model.input_shape[1:3]
+
+    img_paths, mos = labels.load_labeled_images(MOS_PATH, TEST_DIR)
+    if args.limit is not None:
+        img_paths, mos = img_paths[:args.limit], mos[:args.limit]
+
+    report = {}
+    for variant in args.variants:
+        model_bytes = convert(model, variant, height, width, args.samples)
+
+        path = os.path.join(args.out_dir, f'model_{variant}.tflite')
+        with open(path, 'wb') as file:
+            file.write(model_bytes)
+        print(f"Saved {variant} model ({len(model_bytes) / 2**20:.1f} MiB) to {path}")
+
+        report[variant] = evaluate(model_bytes, img_paths, mos, args.threads)
+        report[variant]['size_mib'] = len(model_bytes) / 2**20
+
+    names = list(next(iter(report.values())).keys())
+    print(f"\n{'variant':<10}" + ''.join(f'{name:>16}' for name in names))
+    for variant, results in report.items():
+        print(f'{variant:<10}' + ''.join(f'{results[name]:>16.4f}' for name in names))
+
+if __name__ == '__main__':
+    main()
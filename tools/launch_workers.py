@@ -0,0 +1,42 @@
+import os, sys, json, socket, argparse, subprocess
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(PROJECT_DIR)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+def main():
+    parser = argparse.ArgumentParser(description='Launch train.py as a local multi-worker cluster on localhost; '
+                                                 'any other arguments, e.g. --run or --set, are passed to every worker')
+    parser.add_argument('-n', '--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=None, help='intra-op threads per worker')
+    parser.add_argument('--script', default=f'{PROJECT_DIR}/train.py')
+    args, script_args = parser.parse_known_args()
+
+    cluster = {'worker': [f'localhost:{free_port()}' for _ in range(args.workers)]}
+
+    processes = []
+    for i in range(args.workers):
+        env = dict(os.environ)
+        env['TF_CONFIG'] = json.dumps({'cluster': cluster, 'task': {'type': 'worker', 'index': i}})
+        if args.threads is not None:
+            env['TF_NUM_INTRAOP_THREADS'] = str(args.threads)
+            env['OMP_NUM_THREADS'] = str(args.threads)
+        processes.append(subprocess.Popen([sys.executable, args.script, *script_args], env=env))
+        print(f"Started worker {i} (pid {processes[-1].pid})")
+
+    try:
+        codes = [process.wait() for process in processes]
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        codes = [process.wait() for process in processes]
+
+    print(f"Workers exited with codes {codes}")
+    sys.exit(max(codes, key=abs))
+
+if __name__ == '__main__':
+    main()
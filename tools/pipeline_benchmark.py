@@ -0,0 +1,41 @@
+import os, sys, argparse
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(PROJECT_DIR)
+sys.path.append(f'{PROJECT_DIR}/src')
+
+import images, profiling
+
+IMG_DIR = f'{PROJECT_DIR}/data/images/train'
+
+def main():
+    parser = argparse.ArgumentParser(description='Dataset-only benchmark of the training input pipeline, stage by stage')
+    parser.add_argument('--dir', default=IMG_DIR)
+    parser.add_argument('--limit', type=int, default=2000, help='images per stage measurement')
+    parser.add_argument('--size', type=int, nargs=2, default=(256, 256), metavar=('HEIGHT', 'WIDTH'))
+    parser.add_argument('--crop', type=int, nargs=2, default=(224, 224), metavar=('HEIGHT', 'WIDTH'))
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--train-step', action='store_true',
+                        help='also time the train step of an untrained continuous model, alone and fed by the pipeline')
+    args = parser.parse_args()
+
+    paths = images.get_image_list(args.dir)[:args.limit]
+
+    model = None
+    if args.train_step:
+        import models
+        model = models.init_model_continuous(*args.crop, pretrained=False)
+
+    results = profiling.profile_stages(paths, *args.size, *args.crop, args.batch_size, model=model)
+
+    print(f"{'stage':<10}{'images/sec':>14}{'+ms/image':>12}")
+    for result in results:
+        marginal = result['marginal_ms_per_image']
+        marginal = f'{marginal:>12.3f}' if marginal is not None else f'{"-":>12}'
+        print(f"{result['stage']:<10}{result['images_per_sec']:>14.1f}{marginal}")
+
+        if 'input_wait_fraction' in result:
+            print(f"Input wait: {result['input_wait_fraction']:.1%} of fit time is not spent in the train step")
+
+if __name__ == '__main__':
+    main()
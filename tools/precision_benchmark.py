@@ -0,0 +1,60 @@
+import os, sys, time, argparse
+import numpy as np
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(PROJECT_DIR)
+sys.path.append(f'{PROJECT_DIR}/src')
+
+import tensorflow as tf
+from tensorflow import keras
+
+import models
+
+HEIGHT = 224
+WIDTH = 224
+
+def measure(precision, jit_compile, batch_size, steps, warmup):
+    keras.backend.clear_session()
+    precision = models.set_precision(precision)
+
+    model = models.init_model_continuous(HEIGHT, WIDTH, jit_compile=jit_compile)
+
+    images = np.random.uniform(0, 255, (batch_size, HEIGHT, WIDTH, 3)).astype(np.float32)
+    mos = np.random.uniform(1, 5, (batch_size, 1)).astype(np.float32)
+
+    results = {}
+    for name, step in [('train', lambda: model.train_on_batch(images, mos)), ('predict', lambda: model.predict_on_batch(images))]:
+        for _ in range(warmup):
+            step()
+
+        start = time.perf_counter()
+        for _ in range(steps):
+            step()
+        elapsed = time.perf_counter() - start
+
+        results[name] = steps * batch_size / elapsed
+
+    return precision, results
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare training and inference throughput against the float32 baseline')
+    parser.add_argument('--precision', default='auto', help="policy to compare, e.g. 'mixed_bfloat16' or 'auto'")
+    parser.add_argument('--jit', action='store_true', help='enable XLA for the compared mode')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    args = parser.parse_args()
+
+    modes = [('float32', False), (args.precision, args.jit)]
+
+    baseline = None
+    for precision, jit in modes:
+        precision, results = measure(precision, jit, args.batch_size, args.steps, args.warmup)
+        if baseline is None:
+            baseline = results
+
+        speedups = ', '.join(f'{name} {results[name]:.1f} img/s ({results[name] / baseline[name]:.2f}x)' for name in results)
+        print(f'{precision}, XLA {jit}: {speedups}')
+
+if __name__ == '__main__':
+    main()
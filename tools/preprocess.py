@@ -0,0 +1,45 @@
+import os, sys, argparse
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(PROJECT_DIR)
+sys.path.append(f'{PROJECT_DIR}/src')
+
+import image_cache
+
+DATA_DIR = f'{PROJECT_DIR}/data'
+CACHE_DIR = f'{DATA_DIR}/cache/images'
+
+# train.py reads fit images at 256x256 and validation images at model resolution
+DEFAULT_JOBS = [
+    (f'{DATA_DIR}/images/train', 256, 256),
+    (f'{DATA_DIR}/images/test', 224, 224),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description='Decode and resize image directories once into a uint8 shard cache')
+    parser.add_argument('dirs', nargs='*', help='image directories (default: train and test)')
+    parser.add_argument('--size', type=int, nargs=2, metavar=('HEIGHT', 'WIDTH'), help='target size for all given dirs')
+    parser.add_argument('--out', default=CACHE_DIR, help='cache root directory')
+    parser.add_argument('--shard-size', type=int, default=image_cache.SHARD_SIZE)
+    parser.add_argument('--force', action='store_true', help='rebuild caches that already exist')
+    args = parser.parse_args()
+
+    if args.dirs:
+        if args.size is None:
+            parser.error('--size is required when directories are given')
+        jobs = [(d, *args.size) for d in args.dirs]
+    else:
+        jobs = DEFAULT_JOBS
+
+    for image_dir, height, width in jobs:
+        out_dir = image_cache.cache_path(args.out, image_dir, height, width)
+
+        if image_cache.exists(out_dir) and not args.force:
+            print(f'Skipping {image_dir}: cache exists at {out_dir}')
+            continue
+
+        count = image_cache.build(image_dir, out_dir, height, width, shard_size=args.shard_size)
+        print(f'Cached {count} images from {image_dir} at {height}x{width} in {out_dir}')
+
+if __name__ == '__main__':
+    main()
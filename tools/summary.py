@@ -1,12 +1,10 @@
-import os, sys, json
-import tensorflow as tf
-from tensorflow.keras.utils import plot_model
+import os, sys, json, argparse
 
 PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_DIR = os.path.dirname(PROJECT_DIR)
 sys.path.append(f'{PROJECT_DIR}/src')
 
-import models
+import model_info
 
 MODEL_NAME = ''
 MODEL_PATH = f'{PROJECT_DIR}/output/{MODEL_NAME}/model.keras'
@@ -14,8 +12,22 @@ MODEL_PATH = f'{PROJECT_DIR}/output/{MODEL_NAME}/model.keras'
 HEIGHT = 224
 WIDTH = 224
 
-def main():
-    model = models.load_model(MODEL_PATH)
+def print_info(info):
+    print(f"Hidden layer count: {info['hidden_layers']}")
+    print(f"Loss function: {info['loss']}")
+    print(f"Metrics: {info['metrics']}")
+    print(f"Input shape {info['input_shape']}")
+    print(f"Output shape {info['output_shape']}")
+    print(f"Parameters: {info['total_params']} total, {info['trainable_params']} trainable")
+    print(f"Precision policy: {info['dtype_policy']}")
+    print(f"Optimizer: \n{json.dumps(info['optimizer'], indent=4)}")
+
+def full_summary(path):
+    """Loads the archive: layer table and architecture plot, and backfills the metadata sidecar"""
+    import models
+    from tensorflow.keras.utils import plot_model
+
+    model = models.load_model(path)
 
     model.summary()
 
@@ -31,12 +43,20 @@ def main():
     except Exception as e:
         print(f'Error while plotting the model: {e}')
 
-    print(f"Hidden layer count: {len(model.layers)-2}")
-    print(f"Loss function: {model.loss.name}")
-    print(f"Metrics: {[metric.name for metric in model.metrics]}")
-    print(f"Input shape {model.input_shape}")
-    print(f"Output shape {model.compute_output_shape(model.input_shape)}")
-    print(f"Optimizer: \n{json.dumps(model.optimizer.get_config(), indent=4)}")
+    model_info.write(model, path)
+    return model_info.describe(model)
+
+def main():
+    parser = argparse.ArgumentParser(description='Prints model metadata from the json sidecar written at save time')
+    parser.add_argument('model', nargs='?', default=MODEL_PATH)
+    parser.add_argument('--full', action='store_true', help='load the model for the layer table and architecture plot')
+    args = parser.parse_args()
+
+    info = None if args.full else model_info.read(args.model)
+    if info is None:
+        info = full_summary(args.model)
+
+    print_info(info)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,148 @@
+import os, sys, json, time, argparse, itertools, subprocess
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(PROJECT_DIR)
+sys.path.append(f'{PROJECT_DIR}/src')
+
+import config
+
+IMG_DIR = f'{PROJECT_DIR}/data/images/train'
+TUNING_FILE = f'{PROJECT_DIR}/output/cpu_tuning.json'
+
+HEIGHT = 256
+WIDTH = 256
+MODEL_HEIGHT = 224
+MODEL_WIDTH = 224
+
+def _ints(text):
+    return [int(value) for value in text.split(',')]
+
+def default_grid():
+    cpus = config.available_cpus()
+    return {
+        'intra': sorted({max(cpus // 2, 1), cpus}),
+        'inter': [1, 2],
+        'data_threads': sorted({max(cpus // 4, 1), max(cpus // 2, 1)}),
+        'batch_size': [32, 64],
+    }
+
+def measure(args):
+    """
+    Runs in a fresh process per combination, since tensorflow's pools are sized once at startup.
+    Times the real pipeline: jpeg decoding with images.load_image, random crops and a train step
+    of init_model_continuous, then the same pipeline through predict.
+    """
+    config.pin_cpus(threads=args.intra)
+    config.set_tf_threads(args.intra, args.inter)
+
+    import tensorflow as tf
+    import images, models
+
+    models.set_precision(args.precision)
+    model = models.init_model_continuous(MODEL_HEIGHT, MODEL_WIDTH, jit_compile=args.jit_compile, pretrained=False)
+
+    paths = images.get_image_list(args.dir)[:args.limit]
+
+    def load(path):
+        image = images.load_image(path, HEIGHT, WIDTH)
+        return images.random_crop_image(image, MODEL_HEIGHT, MODEL_WIDTH), tf.zeros([1])
+
+    dataset = (tf.data.Dataset.from_tensor_slices(paths)
+        .repeat()
+        .map(load, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        .batch(args.batch_size, drop_remainder=True)
+        .prefetch(tf.data.experimental.AUTOTUNE)
+    )
+    dataset = config.with_data_threads(dataset, args.data_threads)
+
+    def rate(run):
+        run(args.warmup)
+        start = time.perf_counter()
+        run(args.steps)
+        return args.steps * args.batch_size / (time.perf_counter() - start)
+
+    fit_rate = rate(lambda steps: model.fit(dataset, epochs=1, steps_per_epoch=steps, verbose=0))
+    predict_rate = rate(lambda steps: model.predict(dataset, steps=steps, verbose=0))
+
+    print(json.dumps({'fit_images_per_sec': fit_rate, 'predict_images_per_sec': predict_rate}))
+
+def run_combination(args, intra, inter, data_threads, batch_size):
+    command = [
+        sys.executable, os.path.abspath(__file__), '--measure',
+        '--dir', args.dir, '--limit', str(args.limit), '--steps', str(args.steps), '--warmup', str(args.warmup),
+        '--precision', args.precision,
+        '--intra', str(intra), '--inter', str(inter), '--data-threads', str(data_threads), '--batch-size', str(batch_size),
+    ]
+    if args.jit_compile:
+        command.append('--jit-compile')
+
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        return None
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    grid = default_grid()
+
+    parser = argparse.ArgumentParser(description='Sweeps cpu thread settings over short runs of the real training and inference pipeline '
+                                                 'and writes the fastest ones for train.py and test.py')
+    parser.add_argument('--dir', default=IMG_DIR)
+    parser.add_argument('--limit', type=int, default=512, help='images cycled through by every measurement')
+    parser.add_argument('--steps', type=int, default=20, help='timed steps per measurement')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--precision', default='float32')
+    parser.add_argument('--jit-compile', action='store_true')
+    parser.add_argument('--intra', type=_ints, default=grid['intra'], help='comma-separated values to try')
+    parser.add_argument('--inter', type=_ints, default=grid['inter'])
+    parser.add_argument('--data-threads', type=_ints, default=grid['data_threads'])
+    parser.add_argument('--batch-size', type=_ints, default=grid['batch_size'])
+    parser.add_argument('-o', '--output', default=TUNING_FILE)
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        args.intra, args.inter, args.data_threads, args.batch_size = args.intra[0], args.inter[0], args.data_threads[0], args.batch_size[0]
+        measure(args)
+        return
+
+    results = []
+    combinations = list(itertools.product(args.intra, args.inter, args.data_threads, args.batch_size))
+
+    print(f"{'intra':>6}{'inter':>6}{'data':>6}{'batch':>6}{'fit img/s':>12}{'predict img/s':>15}")
+    for intra, inter, data_threads, batch_size in combinations:
+        rates = run_combination(args, intra, inter, data_threads, batch_size)
+        if rates is None:
+            print(f"{intra:>6}{inter:>6}{data_threads:>6}{batch_size:>6}   failed")
+            continue
+
+        results.append({'intra': intra, 'inter': inter, 'data_threads': data_threads, 'batch_size': batch_size, **rates})
+        print(f"{intra:>6}{inter:>6}{data_threads:>6}{batch_size:>6}{rates['fit_images_per_sec']:>12.1f}{rates['predict_images_per_sec']:>15.1f}")
+
+    if not results:
+        print("Fatal error: every measurement failed")
+        sys.exit(-1)
+
+    fit = max(results, key=lambda r: r['fit_images_per_sec'])
+    predict = max(results, key=lambda r: r['predict_images_per_sec'])
+
+    # the fit batch size changes optimization, not just speed, so it is reported rather than applied
+    tuning = {
+        'cpus': config.available_cpus(),
+        'train': {'INTRA_OP_THREADS': fit['intra'], 'INTER_OP_THREADS': fit['inter'], 'DATA_THREADS': fit['data_threads']},
+        'test': {'INTRA_OP_THREADS': predict['intra'], 'INTER_OP_THREADS': predict['inter'],
+                 'DATA_THREADS': predict['data_threads'], 'BATCH_SIZE': predict['batch_size']},
+        'fastest_fit_batch_size': fit['batch_size'],
+        'results': results,
+    }
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as file:
+        json.dump(tuning, file, indent=4)
+
+    print(f"Training: {fit['fit_images_per_sec']:.1f} images/sec with {tuning['train']}, batch size {fit['batch_size']}")
+    print(f"Inference: {predict['predict_images_per_sec']:.1f} images/sec with {tuning['test']}")
+    print(f"Saved to {args.output}, train.py and test.py apply it on this machine")
+
+if __name__ == '__main__':
+    main()
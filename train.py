@@ -1,90 +1,273 @@
-import os, sys, time, signal, math, datetime, random, traceback
-import tensorflow as tf
+import os, sys, time, signal, math, datetime, random, traceback, tempfile, shutil, argparse, json, zipfile
 import numpy as np
-from tensorboard.plugins.hparams import api as hp
 
 PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(f'{PROJECT_DIR}/src')
 
-import images, labels, models
+import labels, checkpoints, config
+from cli import lazy_import
 from tracker import Tracker
-from batch_callback import BatchCallback
-from weights_callback import WeightsHistogramCallback
-
-# input
+from checkpoints import Checkpointer
+from feature_cache import FeatureCache, crop_key as feature_crop_key
+
+# imported on first use, so --help and --check do not start tensorflow
+tf = lazy_import('tensorflow')
+hp = lazy_import('tensorboard.plugins.hparams.api')
+images = lazy_import('images')
+models = lazy_import('models')
+profiling = lazy_import('profiling')
+image_cache = lazy_import('image_cache')
+
+# input: the labels, image directories and caches under it are set by set_paths()
 DATA_DIR = f'{PROJECT_DIR}/data'
-MOS_FILE = f'{DATA_DIR}/mos.csv'
-FIT_IMG_DIR = f'{DATA_DIR}/images/train'
-VAL_IMG_DIR = f'{DATA_DIR}/images/test'
 
 # logging
 TIMESTAMP = datetime.datetime.now().strftime("%y-%m-%d_%H-%M-%S")
-LOG_FILE = f'{PROJECT_DIR}/logs/{TIMESTAMP}.txt'
+LOG_DIR = f'{PROJECT_DIR}/logs'
+
+# seconds between background log flushes, and between logged batch progress lines
+LOG_FLUSH_INTERVAL = 5.0
+LOG_PROGRESS_INTERVAL = 10.0
 
-# output
+# output: every run owns OUTPUT_ROOT/MODEL_NAME and holds a lock on it while training,
+# so concurrent runs on one host need distinct names (--run NAME)
+OUTPUT_ROOT = f'{PROJECT_DIR}/output'
 MODEL_NAME = ''
-OUTPUT_DIR = f'{PROJECT_DIR}/output/{MODEL_NAME}'
 
-STATUS_FILE = f'{OUTPUT_DIR}/status.ini'
-MODEL_FILE = f'{OUTPUT_DIR}/model.keras'
-BACKUP_FILE = f'{OUTPUT_DIR}/backup.keras'
+# computed from the settings by set_paths() after config overrides, not overridable themselves
+DERIVED = ('PROJECT_DIR', 'TIMESTAMP', 'DERIVED', 'PRECISIONS', 'MOS_FILE', 'FIT_IMG_DIR', 'VAL_IMG_DIR',
+           'FEATURE_CACHE_DIR', 'IMAGE_CACHE_DIR', 'LOG_FILE', 'OUTPUT_DIR', 'STATUS_FILE', 'MODEL_FILE',
+           'BACKUP_FILE', 'HEAD_FILE', 'CHECKPOINT_DIR', 'TEACHER_SCORES_FILE', 'CPU_TUNING_FILE')
+
+def set_paths():
+    global MOS_FILE, FIT_IMG_DIR, VAL_IMG_DIR, FEATURE_CACHE_DIR, IMAGE_CACHE_DIR
+    global LOG_FILE, OUTPUT_DIR, STATUS_FILE, MODEL_FILE, BACKUP_FILE, HEAD_FILE, CHECKPOINT_DIR, TEACHER_SCORES_FILE
+    global CPU_TUNING_FILE
+
+    MOS_FILE = f'{DATA_DIR}/mos.csv'
+    FIT_IMG_DIR = f'{DATA_DIR}/images/train'
+    VAL_IMG_DIR = f'{DATA_DIR}/images/test'
+    FEATURE_CACHE_DIR = f'{DATA_DIR}/cache/features'
+    IMAGE_CACHE_DIR = f'{DATA_DIR}/cache/images'
+
+    LOG_FILE = f'{LOG_DIR}/{MODEL_NAME}_{TIMESTAMP}.txt' if MODEL_NAME else f'{LOG_DIR}/{TIMESTAMP}.txt'
+    OUTPUT_DIR = f'{OUTPUT_ROOT}/{MODEL_NAME}'
+
+    STATUS_FILE = f'{OUTPUT_DIR}/status.ini'
+    MODEL_FILE = f'{OUTPUT_DIR}/model.keras'
+    BACKUP_FILE = f'{OUTPUT_DIR}/backup.keras'
+    HEAD_FILE = f'{OUTPUT_DIR}/head.keras'
+    CHECKPOINT_DIR = f'{OUTPUT_DIR}/checkpoints'
+    TEACHER_SCORES_FILE = f'{OUTPUT_DIR}/teacher_scores.npz'
+
+    # written by tools/tune_threads.py; its train settings apply below any --config or --set overrides,
+    # when tuned on as many available cores; its thread counts are skipped when CPU_CORES pins the run
+    CPU_TUNING_FILE = f'{OUTPUT_ROOT}/cpu_tuning.json'
+
+set_paths()
+
+# per-epoch checkpoints hold only what training changes, written in the background
+KEEP_CHECKPOINTS = 3
 
 HEIGHT = 256
 WIDTH = 256
 MODEL_HEIGHT = 224
 MODEL_WIDTH = 224
 
+# per replica; the global batch is FIT_BATCH_SIZE times the number of replicas
 FIT_BATCH_SIZE = 32
 VAL_BATCH_SIZE = 32
+# gradients of ACCUMULATION_STEPS batches are averaged before each optimizer update, so the effective
+# batch grows while peak memory stays at one batch. Stored in the model file: applies to new models only.
+ACCUMULATION_STEPS = 1
+# exponential learning rate decay, stepped per optimizer update; new full models only
+LR_DECAY = False
 EPOCHS = 40
 LABEL_NOISE = 0.1
 
+# 'float32', 'mixed_bfloat16', 'mixed_float16' or 'auto' (bfloat16 on CPUs with AMX/AVX512-BF16);
+# the output layer and the loss always stay in float32
+PRECISION = 'float32'
+JIT_COMPILE = False
+
+# if set, both backbones are frozen and run once per image; only the head is trained,
+# fed from embeddings cached on disk. Images are center-cropped instead of randomly cropped.
+FEATURE_CACHE = False
+
+# if set, images are read from the uint8 cache built by tools/preprocess.py instead of decoding jpegs
+IMAGE_CACHE = False
+
+# image cache shuffling: shard order is permuted per epoch, SHUFFLE_CYCLE shards are read
+# interleaved, and decoded images are mixed in a buffer of SHUFFLE_BUFFER, so memory does not grow with the dataset
+SHUFFLE_BUFFER = 1024
+SHUFFLE_CYCLE = 4
+
+# if set, a single-backbone student is trained against MOS blended with this teacher model's scores;
+# DISTILL_ALPHA weighs the MOS term. Evaluate the resulting model.keras with test.py as usual.
+TEACHER_FILE = None
+STUDENT_BACKBONE = 'mobilenet'
+DISTILL_ALPHA = 0.5
+
+# input pipeline profiling: input-wait fraction per epoch goes to the log and tensorboard;
+# PROFILE_BATCHES=(start, stop) additionally dumps a tf.profiler trace of those steps;
+# BENCHMARK_PIPELINE iterates one epoch of the fit pipeline without the model and exits
+PROFILE_PIPELINE = False
+PROFILE_BATCHES = None
+BENCHMARK_PIPELINE = False
+
+# data-parallel training: None, 'mirrored' (LOCAL_REPLICAS cpu replicas in this process)
+# or 'multi_worker' (cluster described by TF_CONFIG, see tools/launch_workers.py)
+DISTRIBUTE = 'multi_worker' if 'TF_CONFIG' in os.environ else None
+LOCAL_REPLICAS = 2
+
+# weight histograms, norms, update ratios and dead-relu fractions every INSTRUMENT_FREQ epochs; 0 disables
+INSTRUMENT_FREQ = 1
+
+# cpu placement, for packing several runs onto one node: CPU_CORES pins the process to e.g. '0-15';
+# INTRA_OP_THREADS (default: the pinned core count) and INTER_OP_THREADS size tensorflow's pools
+CPU_CORES = None
+INTRA_OP_THREADS = None
+INTER_OP_THREADS = None
+# size of the private tf.data threadpool of the input pipelines; None shares the inter-op pool
+DATA_THREADS = None
+
 # if set, limits data to n first samples
 FIT_LIMIT = None
 VAL_LIMIT = None
 
+SEED = 23478
+
 tracker = None
+run_lock = None
+checkpointer = None
 model = None
+extractor = None
+feature_cache = None
 fit_mos = None
 fit_imgs = None
 val_mos = None
 val_imgs = None
 batches_per_epoch = None
 
-SEED = 23478
-tf.random.set_seed(SEED)
-np.random.seed(SEED)
-random.seed(SEED)
+strategy = None
+chief = True
+global_batch_size = FIT_BATCH_SIZE
+
+# (id, count) of the input pipeline being built, one per worker in distributed runs
+input_pipeline = (0, 1)
 
-tf.keras.config.enable_unsafe_deserialization()
+PRECISIONS = ('float32', 'mixed_bfloat16', 'mixed_float16', 'auto')
 
 def signal_handler(sig, frame):
     tracker.logprint(f"Received signal {sig}")
+
+    if checkpointer is not None:
+        checkpointer.wait()
     
-    models.save_model(model, BACKUP_FILE)
+    if chief and model is not None:
+        # in feature cache mode this is a backup of the head only
+        models.save_model(model, BACKUP_FILE)
+        tracker.mark_saved(tracker.epoch, tracker.batch)
 
-    tracker.logprint(f"Backup saved at batch {tracker.batch}/{batches_per_epoch} epoch {tracker.epoch}/{EPOCHS}")
+        tracker.logprint(f"Backup saved at batch {tracker.batch}/{batches_per_epoch} epoch {tracker.epoch}/{EPOCHS}")
     tracker.logprint(f"Exiting...")
+    tracker.close()
     sys.exit(0)
 
+def validate_config():
+    """Setting errors that would otherwise only surface after tensorflow has started"""
+    errors = []
+
+    if PRECISION not in PRECISIONS:
+        errors.append(f"PRECISION must be one of {PRECISIONS}, got {PRECISION!r}")
+    if DISTRIBUTE not in (None, 'mirrored', 'multi_worker'):
+        errors.append(f"Unknown DISTRIBUTE mode: {DISTRIBUTE!r}")
+    if ACCUMULATION_STEPS < 1:
+        errors.append("ACCUMULATION_STEPS must be at least 1")
+    if TEACHER_FILE and FEATURE_CACHE:
+        errors.append("distillation trains a full student and cannot use the feature cache")
+    if TEACHER_FILE and not os.path.isfile(TEACHER_FILE):
+        errors.append(f"Teacher model not found at {TEACHER_FILE}")
+    if FEATURE_CACHE and BENCHMARK_PIPELINE:
+        errors.append("BENCHMARK_PIPELINE times the image pipeline, which the feature cache replaces")
+    if FEATURE_CACHE and DISTRIBUTE:
+        errors.append("the feature cache is filled by a single process and cannot be used in distributed runs")
+    if CPU_CORES is not None:
+        try:
+            config.parse_cores(CPU_CORES)
+        except ValueError:
+            errors.append(f"CPU_CORES must look like '0-7,16-23', got {CPU_CORES!r}")
+    if not os.path.isfile(MOS_FILE):
+        errors.append(f"MOS file not found at {MOS_FILE}")
+    for img_dir in [FIT_IMG_DIR, VAL_IMG_DIR]:
+        if not os.path.isdir(img_dir):
+            errors.append(f"Image directory not found at {img_dir}")
+
+    return errors
+
+def check():
+    """Validates the settings and scans the dataset, without tensorflow"""
+    errors = validate_config()
+    for error in errors:
+        print(f"Config error: {error}")
+    if errors:
+        return False
+
+    fit_imgs, _ = labels.load_labeled_images(MOS_FILE, FIT_IMG_DIR)
+    val_imgs, _ = labels.load_labeled_images(MOS_FILE, VAL_IMG_DIR)
+    fit_count = min(len(fit_imgs), FIT_LIMIT or len(fit_imgs))
+    val_count = min(len(val_imgs), VAL_LIMIT or len(val_imgs))
+
+    print(f"Labeled images: {fit_count} fit, {val_count} validation")
+    print(f"Batches per epoch on one replica: {math.ceil(fit_count / FIT_BATCH_SIZE)}, "
+          f"optimizer updates per epoch: {math.ceil(fit_count / FIT_BATCH_SIZE / ACCUMULATION_STEPS)}")
+
+    if os.path.isfile(STATUS_FILE):
+        print(f"Existing run in {OUTPUT_DIR} will be resumed")
+    return True
+
+def initialize_strategy():
+    global strategy, chief, global_batch_size
+
+    if DISTRIBUTE == 'multi_worker':
+        strategy = tf.distribute.MultiWorkerMirroredStrategy()
+        resolver = strategy.cluster_resolver
+        has_chief = 'chief' in resolver.cluster_spec().as_dict()
+        chief = resolver.task_type == 'chief' or (resolver.task_type == 'worker' and resolver.task_id == 0 and not has_chief)
+    elif DISTRIBUTE == 'mirrored':
+        cpu = tf.config.list_physical_devices('CPU')[0]
+        tf.config.set_logical_device_configuration(cpu, [tf.config.LogicalDeviceConfiguration()] * LOCAL_REPLICAS)
+        strategy = tf.distribute.MirroredStrategy([f'/cpu:{i}' for i in range(LOCAL_REPLICAS)])
+    else:
+        strategy = tf.distribute.get_strategy()
+
+    global_batch_size = FIT_BATCH_SIZE * strategy.num_replicas_in_sync
+
+def distributed():
+    return strategy.num_replicas_in_sync > 1
+
+def barrier():
+    """Blocks until every worker gets here: a collective all-reduce only completes once all of them join"""
+    if distributed():
+        strategy.reduce(tf.distribute.ReduceOp.SUM, strategy.run(lambda: tf.constant(1.0)), axis=None)
+
 def initialize_resources():
     global fit_mos, fit_imgs, val_mos, val_imgs, batches_per_epoch
 
-    fit_imgs = images.get_image_list(FIT_IMG_DIR)
-    fit_mos = labels.load_continuous(MOS_FILE, FIT_IMG_DIR)
-    tracker.logprint(f"Detected {len(fit_mos)} labels and {len(fit_imgs)} images")
+    fit_imgs, fit_mos = labels.load_labeled_images(MOS_FILE, FIT_IMG_DIR)
+    tracker.logprint(f"Detected {len(fit_mos)} labeled images")
 
     if FIT_LIMIT != None:
         fit_imgs = fit_imgs[:FIT_LIMIT]
         fit_mos = fit_mos[:FIT_LIMIT]
         tracker.logprint(f"Limiting data to {FIT_LIMIT} first samples")
 
-    extra_batch_required = len(fit_imgs) % FIT_BATCH_SIZE != 0
-    batches_per_epoch = math.floor(len(fit_imgs)/FIT_BATCH_SIZE) + extra_batch_required
+    # replicas must step together, so distributed runs drop the last partial batch
+    extra_batch_required = len(fit_imgs) % global_batch_size != 0 and not distributed()
+    batches_per_epoch = math.floor(len(fit_imgs)/global_batch_size) + extra_batch_required
 
-    val_mos = labels.load_continuous(MOS_FILE, VAL_IMG_DIR)
-    val_imgs = images.get_image_list(VAL_IMG_DIR)
-    tracker.logprint(f"Detected {len(val_mos)} validation labels and validation {len(val_imgs)} images")
+    val_imgs, val_mos = labels.load_labeled_images(MOS_FILE, VAL_IMG_DIR)
+    tracker.logprint(f"Detected {len(val_mos)} labeled validation images")
 
     if VAL_LIMIT != None:
         val_mos = val_mos[:FIT_LIMIT]
@@ -95,36 +278,168 @@ def log_hparams():
     global model
     hparams = {
         'resolution': f'{HEIGHT}x{WIDTH}',
-        'batch_size': FIT_BATCH_SIZE,
+        'batch_size': global_batch_size,
+        'accumulation_steps': ACCUMULATION_STEPS,
+        'effective_batch_size': global_batch_size * ACCUMULATION_STEPS,
+        'lr_decay': LR_DECAY,
+        'replicas': strategy.num_replicas_in_sync,
         'epochs': EPOCHS,
         'total_layers': len(model.layers),
         'optimizer': model.optimizer.__class__.__name__,
         'trainable_params': model.count_params(),
         'loss': model.loss.__class__.__name__,
         'label-noise': LABEL_NOISE,
+        'precision': PRECISION,
+        'jit_compile': JIT_COMPILE,
+        'teacher': os.path.basename(TEACHER_FILE) if TEACHER_FILE else '',
+        'distill_alpha': DISTILL_ALPHA if TEACHER_FILE else 1.0,
     }
 
     print(hparams)
 
+    if not chief:
+        return
+
     writer = tf.summary.create_file_writer(OUTPUT_DIR)
     with writer.as_default():
         hp.hparams(hparams)
 
+def resume_file(model_file):
+    """Prefers the mid-epoch backup when the status points into an epoch and the backup is newer"""
+    if tracker.saved_batch == 0:
+        return model_file
+
+    backup_is_newer = os.path.isfile(BACKUP_FILE) and (
+        not os.path.isfile(model_file) or os.path.getmtime(BACKUP_FILE) > os.path.getmtime(model_file)
+    )
+    if backup_is_newer:
+        tracker.logprint(f"Resuming from backup at batch {tracker.saved_batch} of epoch {tracker.epoch}")
+        return BACKUP_FILE
+
+    tracker.logprint(f"No usable backup, restarting epoch {tracker.epoch} from its first batch")
+    tracker.saved_batch = 0
+    tracker.batch = 0
+    return model_file
+
+def restore_checkpoint(model_file):
+    """Applies the newest incremental checkpoint on top of the base archive, if it is newer than it"""
+    found = checkpoints.list_checkpoints(CHECKPOINT_DIR)
+    if model_file == BACKUP_FILE or not found:
+        return
+
+    epoch, path = found[-1]
+    if os.path.getmtime(path) <= os.path.getmtime(model_file):
+        return
+
+    checkpoints.restore(model, path)
+    tracker.epoch = epoch
+    tracker.saved_epoch = epoch
+    tracker.logprint(f"Restored checkpoint of epoch {epoch}")
+
+def compute_teacher_scores(teacher, paths):
+    dataset = (tf.data.Dataset.from_tensor_slices((paths, np.zeros(len(paths), dtype=np.float32)))
+        .map(load_val_image, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        .batch(VAL_BATCH_SIZE)
+        .prefetch(tf.data.experimental.AUTOTUNE)
+    )
+    return teacher.predict(dataset).flatten()
+
+def initialize_distillation():
+    """Turns fit and validation labels into [mos, teacher score] pairs; teacher scores are computed once and cached"""
+    global fit_mos, val_mos
+
+    teacher_mtime = os.path.getmtime(TEACHER_FILE)
+    cached = None
+    if os.path.isfile(TEACHER_SCORES_FILE):
+        try:
+            with np.load(TEACHER_SCORES_FILE) as data:
+                if data['teacher_mtime'] == teacher_mtime and np.array_equal(data['fit_imgs'], fit_imgs) and np.array_equal(data['val_imgs'], val_imgs):
+                    cached = data['fit_scores'], data['val_scores']
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile) as e:
+            tracker.logprint(f"Ignoring unreadable teacher scores at {TEACHER_SCORES_FILE}: {e}")
+
+    if cached is not None:
+        fit_scores, val_scores = cached
+        tracker.logprint(f"Loaded cached teacher scores")
+    else:
+        teacher = models.load_model(TEACHER_FILE)
+        fit_scores = compute_teacher_scores(teacher, fit_imgs)
+        val_scores = compute_teacher_scores(teacher, val_imgs)
+        del teacher
+
+        if chief:
+            # write-and-rename under a unique name: other workers may load the file while it is written
+            with tempfile.NamedTemporaryFile(dir=OUTPUT_DIR, suffix='.tmp', delete=False) as file:
+                np.savez(file, teacher_mtime=teacher_mtime, fit_imgs=fit_imgs, val_imgs=val_imgs, fit_scores=fit_scores, val_scores=val_scores)
+            os.replace(file.name, TEACHER_SCORES_FILE)
+        tracker.logprint(f"Computed teacher scores with {TEACHER_FILE}")
+
+    fit_mos = np.stack([fit_mos, fit_scores], axis=-1).astype(np.float32)
+    val_mos = np.stack([val_mos, val_scores], axis=-1).astype(np.float32)
+
+def initialize_cached_model():
+    global model, extractor, feature_cache
+
+    extractor = models.init_feature_extractor(MODEL_HEIGHT, MODEL_WIDTH)
+
+    crop_key = feature_crop_key(HEIGHT, WIDTH, MODEL_HEIGHT, MODEL_WIDTH, PRECISION)
+    feature_cache = FeatureCache.for_extractor(FEATURE_CACHE_DIR, extractor, crop_key)
+
+    for paths in [fit_imgs, val_imgs]:
+        computed = feature_cache.fill(paths, load_cache_image, batch_size=VAL_BATCH_SIZE)
+        tracker.logprint(f"Feature cache: computed {computed}, reused {len(paths) - computed} embeddings")
+
+    head_file = resume_file(HEAD_FILE)
+    if os.path.isfile(head_file):
+        try:
+            model = models.load_model(head_file, jit_compile=JIT_COMPILE)
+            tracker.logprint(f"Loaded head from file")
+            restore_checkpoint(head_file)
+        except Exception as e:
+            tracker.logprint(f"Fatal error while loading head file at: {head_file}")
+            traceback.print_exc()
+            sys.exit(-1)
+    else:
+        model = models.init_head_continuous(feature_cache.shapes, jit_compile=JIT_COMPILE, accumulation_steps=ACCUMULATION_STEPS)
+        if chief:
+            models.save_model(model, HEAD_FILE)
+        tracker.logprint(f"Initialized new head")
+
+    model.summary()
+    log_hparams()
+
 def initialize_model():
     global model
     
-    if os.path.isfile(MODEL_FILE):
+    model_file = resume_file(MODEL_FILE)
+    resuming = os.path.isfile(model_file)
+
+    # every worker decides before the chief can start writing a fresh base archive, so none of them
+    # reads it half-written or takes a different path; fresh models come from the seed on all workers
+    barrier()
+
+    if resuming:
         try:
-            model = models.load_model(MODEL_FILE)
+            model = models.load_model(model_file, jit_compile=JIT_COMPILE)
             tracker.logprint(f"Loaded model from file")
+            restore_checkpoint(model_file)
         except Exception as e:
-            tracker.logprint(f"Fatal error while loading model file at: {MODEL_FILE}")
+            tracker.logprint(f"Fatal error while loading model file at: {model_file}")
             traceback.print_exc()
             sys.exit(-1)
     else:
         try:
-            model = models.init_model_continuous(MODEL_HEIGHT, MODEL_WIDTH)
-            tf.keras.utils.plot_model(model, to_file=f"{OUTPUT_DIR}/arch.png", show_shapes=True, show_dtype=True, show_layer_names=True)
+            if TEACHER_FILE:
+                model = models.init_student_continuous(MODEL_HEIGHT, MODEL_WIDTH, STUDENT_BACKBONE, DISTILL_ALPHA, jit_compile=JIT_COMPILE,
+                                                       accumulation_steps=ACCUMULATION_STEPS, lr_decay=LR_DECAY)
+            else:
+                model = models.init_model_continuous(MODEL_HEIGHT, MODEL_WIDTH, jit_compile=JIT_COMPILE,
+                                                     accumulation_steps=ACCUMULATION_STEPS, lr_decay=LR_DECAY)
+
+            if chief:
+                # base archive for the incremental checkpoints
+                models.save_model(model, MODEL_FILE)
+                tf.keras.utils.plot_model(model, to_file=f"{OUTPUT_DIR}/arch.png", show_shapes=True, show_dtype=True, show_layer_names=True)
             tracker.logprint(f"Initialized new model")
         except Exception as e:
             tracker.logprint(f"Fatal error while initializing model")
@@ -138,65 +453,335 @@ def load_val_image(path, label):
     image = images.load_image(path, MODEL_HEIGHT, MODEL_WIDTH)
     return image, label
 
-def load_fit_image(path, label):
-    image = images.load_image(path, HEIGHT, WIDTH)
-    image = tf.image.random_crop(image, [MODEL_HEIGHT, MODEL_WIDTH, 3], seed=SEED)
+def load_cache_image(path):
+    return images.load_center_cropped(path, HEIGHT, WIDTH, MODEL_HEIGHT, MODEL_WIDTH)
 
-    noise = tf.random.normal(shape=(), mean=0.0, stddev=LABEL_NOISE)
-    return image, label + noise
+def add_label_noise(features, label):
+    noise = tf.random.normal(shape=tf.shape(label), mean=0.0, stddev=LABEL_NOISE)
+    return features, label + noise
 
-def main():
-    global model, tracker
-
-    os.makedirs(os.path.dirname(OUTPUT_DIR), exist_ok=True)
-
-    tracker = Tracker(log_path=LOG_FILE, status_path=STATUS_FILE)
+def augment_fit_image(image, label):
+    image = tf.image.random_crop(image, [MODEL_HEIGHT, MODEL_WIDTH, 3], seed=SEED)
 
-    tracker.logprint("Program starting up...")
+    noise = tf.random.normal(shape=tf.shape(label), mean=0.0, stddev=LABEL_NOISE)
+    return image, label + noise
 
-    initialize_resources()
-    initialize_model()
+def load_fit_image(path, label):
+    image = images.load_image(path, HEIGHT, WIDTH)
+    return augment_fit_image(image, label)
+
+def epoch_seed(epoch):
+    """Shuffle seed that depends only on SEED and the epoch, so the order is identical after a restart"""
+    return tf.stack([tf.constant(SEED, tf.int64), tf.cast(epoch, tf.int64)])
+
+def epoch_order(epoch, skip=0):
+    """Epoch permutation of the fit set, restricted to the current input pipeline's share"""
+    order = tf.random.experimental.stateless_shuffle(tf.range(len(fit_imgs), dtype=tf.int64), seed=epoch_seed(epoch))
+    if not distributed():
+        return order[skip:]
+
+    pipeline_id, pipelines = input_pipeline
+    order = order[:batches_per_epoch * global_batch_size]
+    return order[pipeline_id::pipelines][skip // pipelines:]
+
+def shard_dataset(dataset, skip=0):
+    """Same split as epoch_order, for sources that are not indexed by the permutation"""
+    if not distributed():
+        return dataset.skip(skip)
+
+    pipeline_id, pipelines = input_pipeline
+    return (dataset
+        .take(batches_per_epoch * global_batch_size)
+        .shard(pipelines, pipeline_id)
+        .skip(skip // pipelines)
+    )
 
-    dataset = (tf.data.Dataset.from_tensor_slices((fit_imgs, fit_mos))
-        .shuffle(buffer_size=len(fit_imgs), seed=SEED)
+def file_epoch(epoch, skip):
+    order = epoch_order(epoch, skip)
+    return (tf.data.Dataset.from_tensor_slices((tf.gather(fit_imgs, order), tf.gather(fit_mos, order)))
         .map(load_fit_image, num_parallel_calls=tf.data.experimental.AUTOTUNE)
-        .batch(FIT_BATCH_SIZE)
-        .prefetch(tf.data.experimental.AUTOTUNE)
+        .batch(FIT_BATCH_SIZE, drop_remainder=distributed())
     )
 
+def fit_datasets(make_epoch, first_epoch, skip_batches, input_wait=None):
+    """
+    Returns (partial, full): the rest of a resumed epoch, or None, and a stream of whole epochs after it.
+    make_epoch(epoch, skip) builds one epoch, batched per replica, without its first `skip` samples.
+    Every epoch is batched separately so batch boundaries match an uninterrupted run.
+    In distributed runs each worker builds its own shard of the data.
+    input_wait, an InputWaitCallback, gets its timing stage appended to both.
+    """
+    skip = skip_batches * global_batch_size
+    full_from = first_epoch + 1 if skip_batches > 0 else first_epoch
+
+    def finish(dataset):
+        dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
+        if input_wait is not None:
+            dataset = input_wait.timed(dataset)
+        return config.with_data_threads(dataset, DATA_THREADS)
+
+    def partial_fn(context=None):
+        set_input_pipeline(context)
+        return finish(make_epoch(first_epoch, skip))
+
+    def full_fn(context=None):
+        set_input_pipeline(context)
+        return finish(tf.data.Dataset.range(full_from, EPOCHS).flat_map(lambda epoch: make_epoch(epoch, 0)))
+
+    if distributed():
+        partial = strategy.distribute_datasets_from_function(partial_fn) if skip_batches > 0 else None
+        return partial, strategy.distribute_datasets_from_function(full_fn)
+
+    partial = partial_fn() if skip_batches > 0 else None
+    return partial, full_fn()
+
+def set_input_pipeline(context):
+    global input_pipeline
+    if context is not None:
+        input_pipeline = (context.input_pipeline_id, context.num_input_pipelines)
+
+def file_datasets():
     val_dataset = (tf.data.Dataset.from_tensor_slices((val_imgs, val_mos))
         .map(load_val_image, num_parallel_calls=tf.data.experimental.AUTOTUNE)
         .batch(VAL_BATCH_SIZE)
         .prefetch(tf.data.experimental.AUTOTUNE)
     )
+    return file_epoch, val_dataset
+
+def open_image_cache(image_dir, img_paths, height, width):
+    """The preprocessed cache of image_dir, or None if it is missing or does not hold every image at height x width"""
+    cache_dir = image_cache.cache_path(IMAGE_CACHE_DIR, image_dir, height, width)
+    if not image_cache.exists(cache_dir):
+        tracker.logprint(f"No preprocessed cache at {cache_dir}, build it with tools/preprocess.py")
+        return None
+
+    cache = image_cache.ImageCache(cache_dir)
+    if not cache.covers(img_paths, height, width):
+        tracker.logprint(f"Preprocessed cache at {cache_dir} does not match the labeled images, rebuild it with tools/preprocess.py --force")
+        return None
+    return cache
+
+def cached_datasets():
+    """Falls back to decoding the jpegs, as without IMAGE_CACHE, when either cache is unusable"""
+    fit_cache = open_image_cache(FIT_IMG_DIR, fit_imgs, HEIGHT, WIDTH)
+    val_cache = open_image_cache(VAL_IMG_DIR, val_imgs, MODEL_HEIGHT, MODEL_WIDTH)
+    if fit_cache is None or val_cache is None:
+        tracker.logprint("Decoding images instead of reading the preprocessed cache")
+        return file_datasets()
+    tracker.logprint(f"Reading images from preprocessed cache")
+
+    fit_rows = fit_cache.lookup(fit_imgs)
+
+    def make_epoch(epoch, skip):
+        return (shard_dataset(fit_cache.shuffled_dataset(fit_rows, fit_mos, epoch_seed(epoch), SHUFFLE_BUFFER, SHUFFLE_CYCLE), skip)
+            .map(augment_fit_image, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+            .batch(FIT_BATCH_SIZE, drop_remainder=distributed())
+        )
+
+    val_dataset = (val_cache.dataset(val_cache.lookup(val_imgs), val_mos)
+        .batch(VAL_BATCH_SIZE)
+        .prefetch(tf.data.experimental.AUTOTUNE)
+    )
+
+    return make_epoch, val_dataset
 
-    batch_callback = BatchCallback(tracker, EPOCHS, MODEL_FILE, batches_per_epoch)
-    weights_callback = WeightsHistogramCallback(log_dir=OUTPUT_DIR)
+def feature_datasets():
+    fit_rows = feature_cache.lookup(fit_imgs)
 
-    tensorboard_callback = tf.keras.callbacks.TensorBoard(
-        log_dir=OUTPUT_DIR,
-        write_graph=True,
-        histogram_freq=1,
+    def make_epoch(epoch, skip):
+        order = epoch_order(epoch, skip)
+        return (feature_cache.dataset(tf.gather(fit_rows, order), tf.gather(fit_mos, order), FIT_BATCH_SIZE)
+            .map(add_label_noise)
+        )
+
+    val_dataset = (feature_cache.dataset(feature_cache.lookup(val_imgs), val_mos, VAL_BATCH_SIZE)
+        .prefetch(tf.data.experimental.AUTOTUNE)
     )
 
-    early_stopping = tf.keras.callbacks.EarlyStopping(
+    return make_epoch, val_dataset
+
+def benchmark_pipeline():
+    """Dataset-only throughput of one epoch of the fit pipeline; no model is built and the run directory is not touched"""
+    global tracker
+
+    scratch = tempfile.mkdtemp(prefix='iqa-benchmark-')
+    tracker = Tracker(log_path=f'{scratch}/log.txt', status_path=f'{scratch}/status.ini')
+
+    errors = validate_config()
+    if errors:
+        for error in errors:
+            tracker.logprint(f"Fatal error: {error}")
+        sys.exit(-1)
+
+    initialize_resources()
+    make_epoch, _ = cached_datasets() if IMAGE_CACHE else file_datasets()
+
+    rate = profiling.measure(make_epoch(0, 0).take(batches_per_epoch), FIT_BATCH_SIZE)
+    tracker.logprint(f"Dataset-only benchmark: {rate:.1f} images/sec")
+
+    tracker.close()
+    shutil.rmtree(scratch, ignore_errors=True)
+
+def main():
+    global model, tracker, checkpointer, run_lock, PRECISION
+
+    # before tensorflow is imported, which sizes its pools once at startup; numpy's are already sized, only affinity applies to them
+    cores = config.pin_cpus(CPU_CORES, INTRA_OP_THREADS)
+    config.set_tf_threads(INTRA_OP_THREADS or (len(cores) if cores else None), INTER_OP_THREADS)
+
+    from batch_callback import BatchCallback, ContinuedEarlyStopping
+    from instrumentation import InstrumentationCallback
+
+    tf.random.set_seed(SEED)
+    np.random.seed(SEED)
+    random.seed(SEED)
+    tf.keras.config.enable_unsafe_deserialization()
+
+    # must come before any other tensorflow op
+    initialize_strategy()
+
+    if BENCHMARK_PIPELINE:
+        benchmark_pipeline()
+        return
+
+    os.makedirs(LOG_DIR, exist_ok=True)
+
+    if chief:
+        run_lock = config.lock_run_dir(OUTPUT_DIR)
+        if run_lock is None:
+            print(f"Fatal error: another run is using {OUTPUT_DIR}, choose a different name with --run")
+            sys.exit(-1)
+        config.dump(globals(), f'{OUTPUT_DIR}/{config.CONFIG_NAME}', DERIVED)
+
+        tracker = Tracker(log_path=LOG_FILE, status_path=STATUS_FILE, flush_interval=LOG_FLUSH_INTERVAL, progress_interval=LOG_PROGRESS_INTERVAL)
+        checkpointer = Checkpointer(CHECKPOINT_DIR, keep=KEEP_CHECKPOINTS)
+    else:
+        # other workers read the shared status but write their own log and throwaway checkpoints
+        scratch = tempfile.mkdtemp(prefix='iqa-worker-')
+        if os.path.isfile(STATUS_FILE):
+            shutil.copy(STATUS_FILE, f'{scratch}/status.ini')
+        worker_log = LOG_FILE.replace('.txt', f'_worker{strategy.cluster_resolver.task_id}.txt')
+        tracker = Tracker(log_path=worker_log, status_path=f'{scratch}/status.ini', flush_interval=LOG_FLUSH_INTERVAL, progress_interval=LOG_PROGRESS_INTERVAL)
+        checkpointer = Checkpointer(f'{scratch}/checkpoints', keep=1)
+
+    tracker.logprint("Program starting up...")
+
+    errors = validate_config()
+    if errors:
+        for error in errors:
+            tracker.logprint(f"Fatal error: {error}")
+        tracker.close()
+        sys.exit(-1)
+
+    tracker.logprint(f"Replicas: {strategy.num_replicas_in_sync}, global batch size: {global_batch_size}, accumulated over {ACCUMULATION_STEPS}, chief: {chief}")
+
+    PRECISION = models.set_precision(PRECISION)
+    tracker.logprint(f"Precision policy: {PRECISION}, XLA: {JIT_COMPILE}")
+
+    initialize_resources()
+
+    if TEACHER_FILE:
+        initialize_distillation()
+
+    if FEATURE_CACHE:
+        initialize_cached_model()
+        make_epoch, val_dataset = feature_datasets()
+    else:
+        with strategy.scope():
+            initialize_model()
+        make_epoch, val_dataset = cached_datasets() if IMAGE_CACHE else file_datasets()
+    val_dataset = config.with_data_threads(val_dataset, DATA_THREADS)
+
+    # summaries are written by the chief only
+    input_wait = profiling.InputWaitCallback(tracker, OUTPUT_DIR) if PROFILE_PIPELINE and chief else None
+    partial_dataset, dataset = fit_datasets(make_epoch, tracker.epoch, tracker.saved_batch, input_wait)
+
+    batch_callback = BatchCallback(tracker, EPOCHS, checkpointer, batches_per_epoch, initial_batch=tracker.saved_batch)
+
+    early_stopping = ContinuedEarlyStopping(
         monitor='val_loss',
         patience=5,
         restore_best_weights=True
     )
 
-    history = model.fit(
-        dataset,
-        verbose=1,
-        validation_data=val_dataset,
-        initial_epoch=tracker.epoch,
-        epochs=EPOCHS,
-        callbacks=[batch_callback, tensorboard_callback, weights_callback, early_stopping]
-    )
+    callbacks = [batch_callback, early_stopping]
+
+    # summaries are written by the chief only
+    if chief:
+        # histograms come from InstrumentationCallback only
+        tensorboard_callback = tf.keras.callbacks.TensorBoard(
+            log_dir=OUTPUT_DIR,
+            write_graph=True,
+            histogram_freq=0,
+            profile_batch=PROFILE_BATCHES or 0,
+        )
+
+        callbacks.append(tensorboard_callback)
+        if INSTRUMENT_FREQ:
+            probe, _ = next(iter(val_dataset.take(1)))
+            callbacks.append(InstrumentationCallback(OUTPUT_DIR, freq=INSTRUMENT_FREQ, probe=probe))
+        if input_wait is not None:
+            callbacks.append(input_wait)
+
+    if partial_dataset is not None:
+        model.fit(
+            partial_dataset,
+            verbose=1,
+            validation_data=val_dataset,
+            initial_epoch=tracker.epoch,
+            epochs=tracker.epoch + 1,
+            steps_per_epoch=batches_per_epoch - tracker.saved_batch,
+            callbacks=callbacks
+        )
+
+    if tracker.epoch < EPOCHS and not model.stop_training:
+        history = model.fit(
+            dataset,
+            verbose=1,
+            validation_data=val_dataset,
+            initial_epoch=tracker.epoch,
+            epochs=EPOCHS,
+            steps_per_epoch=batches_per_epoch,
+            callbacks=callbacks
+        )
+
+    if chief and FEATURE_CACHE:
+        models.save_model(model, HEAD_FILE)
+
+        # test.py and tools expect a single image -> score model
+        models.save_model(models.assemble_model(extractor, model), MODEL_FILE)
+        tracker.logprint("Saved assembled model")
+    elif chief:
+        models.save_model(model, MODEL_FILE)
+        tracker.logprint("Saved model")
 
     tracker.logprint("Program completed")
+    tracker.close()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Trains the quality model configured by the constants at the top of train.py')
+    parser.add_argument('--check', action='store_true', help='validate the settings and scan the dataset without starting tensorflow, then exit')
+    config.add_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        values = config.overrides(args)
+        config.apply(globals(), values, DERIVED)
+        set_paths()
+
+        tuning = config.tuned(CPU_TUNING_FILE, 'train', pinned=CPU_CORES is not None)
+        config.apply(globals(), {name: value for name, value in tuning.items() if name not in values}, DERIVED)
+    except (config.ConfigError, OSError, json.JSONDecodeError) as e:
+        print(f"Config error: {e}")
+        sys.exit(1)
+
+    if args.print_config:
+        print(json.dumps(config.settings(globals(), DERIVED), indent=4))
+        sys.exit(0)
+
+    if args.check:
+        sys.exit(0 if check() else 1)
+
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
     main()